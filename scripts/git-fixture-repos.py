@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Generate pathological bare repositories for benchmarking git-server.py
+Every repository is built with git fast-import from a seed, so the same seed
+and sizes give the same objects and commit ids. A fixtures.json manifest
+lists the notable trees and files of each one for the micro-benchmarks.
+"""
+
+import os
+import sys
+import argparse
+import json
+import random
+import shutil
+import subprocess
+import time
+
+# Fixtures and their default sizes
+FIXTURES = ('wide-tree', 'long-history', 'huge-blob', 'many-refs')
+TREE_ENTRIES = 20000            # files in the one wide directory
+HISTORY_COMMITS = 100000        # commits in the long history
+HISTORY_FILES = 2000            # files those commits keep modifying
+BLOB_SIZE = 2 * 1024 ** 3       # bytes of the huge binary blob
+TEXT_BLOB_SIZE = 16 * 1024 ** 2 # bytes of the large text file next to it
+BRANCHES = 5000
+TAGS = 5000
+
+SEED = 1
+EPOCH = 1600000000              # commit timestamps count up from here
+WRITE_CHUNK = 1024 * 1024
+
+WORDS = ('git', 'server', 'tree', 'blob', 'commit', 'branch', 'merge', 'fetch', 'clone', 'pack',
+         'index', 'object', 'delta', 'ref', 'tag', 'push', 'cache', 'request', 'render', 'history')
+
+
+def parse_size(value):
+    """Byte count with an optional K/M/G suffix"""
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class FastImport:
+    """Writes a git fast-import stream into a new bare repository"""
+
+    def __init__(self, repo_path):
+        subprocess.run(['git', 'init', '-q', '--bare', '--initial-branch=main', repo_path], check=True)
+        self.process = subprocess.Popen(
+            ['git', 'fast-import', '--quiet', '--done'],
+            cwd=repo_path, stdin=subprocess.PIPE
+        )
+        self.out = self.process.stdin
+        self._mark = 0
+        self._clock = EPOCH
+
+    def _next_mark(self):
+        self._mark += 1
+        return self._mark
+
+    def _data(self, payload):
+        self.out.write(b'data %d\n' % len(payload))
+        self.out.write(payload)
+        self.out.write(b'\n')
+
+    def blob(self, payload):
+        mark = self._next_mark()
+        self.out.write(b'blob\nmark :%d\n' % mark)
+        self._data(payload)
+        return mark
+
+    def streamed_blob(self, size, chunks):
+        """A blob of size bytes written from an iterable of chunks, never held in memory whole"""
+        mark = self._next_mark()
+        self.out.write(b'blob\nmark :%d\ndata %d\n' % (mark, size))
+        written = 0
+        for chunk in chunks:
+            self.out.write(chunk)
+            written += len(chunk)
+        if written != size:
+            raise ValueError(f"streamed blob is {written} bytes, declared {size}")
+        self.out.write(b'\n')
+        return mark
+
+    def commit(self, ref, message, files, parent=None):
+        """Commit files [(path, blob mark)] on ref; returns the commit's mark"""
+        mark = self._next_mark()
+        self._clock += 60
+        self.out.write(b'commit %s\nmark :%d\n' % (ref.encode(), mark))
+        self.out.write(b'author Fixture <fixture@example.com> %d +0000\n' % self._clock)
+        self.out.write(b'committer Fixture <fixture@example.com> %d +0000\n' % self._clock)
+        self._data(message.encode())
+        if parent is not None:
+            self.out.write(b'from :%d\n' % parent)
+        for path, blob in files:
+            self.out.write(b'M 100644 :%d %s\n' % (blob, path.encode()))
+        self.out.write(b'\n')
+        return mark
+
+    def branch(self, ref, commit):
+        self.out.write(b'reset %s\nfrom :%d\n\n' % (ref.encode(), commit))
+
+    def tag(self, name, commit, message):
+        self._clock += 1
+        self.out.write(b'tag %s\nfrom :%d\n' % (name.encode(), commit))
+        self.out.write(b'tagger Fixture <fixture@example.com> %d +0000\n' % self._clock)
+        self._data(message.encode())
+
+    def close(self):
+        self.out.write(b'done\n')
+        self.out.close()
+        if self.process.wait() != 0:
+            raise RuntimeError("git fast-import failed")
+
+
+def text(rng, lines):
+    return ''.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) + '\n'
+                   for _ in range(lines)).encode()
+
+
+def build_wide_tree(repo_path, rng, args):
+    """One directory with --tree-entries files, plus a commit touching a sample of them"""
+    stream = FastImport(repo_path)
+    entries = [f'wide/entry-{i:05d}.txt' for i in range(args.tree_entries)]
+    files = [(path, stream.blob(text(rng, rng.randint(1, 20)))) for path in entries]
+    files.append(('README.md', stream.blob(b'# wide-tree\n')))
+    first = stream.commit('refs/heads/main', 'Add wide directory', files)
+    touched = rng.sample(entries, min(100, len(entries)))
+    stream.commit('refs/heads/main', 'Touch some entries',
+                  [(path, stream.blob(text(rng, 5))) for path in touched], parent=first)
+    stream.close()
+    return {'trees': ['', 'wide'], 'files': [entries[0], touched[0]]}
+
+
+def build_long_history(repo_path, rng, args):
+    """--commits commits, each modifying one to three of --history-files files.
+
+    LICENSE is only touched by the first commit, so finding its last commit
+    means walking the whole history.
+    """
+    stream = FastImport(repo_path)
+    directories = [f'src/module{i:02d}' for i in range(max(args.history_files // 100, 1))]
+    paths = [f'{rng.choice(directories)}/file{i:05d}.txt' for i in range(args.history_files)]
+    files = [(path, stream.blob(text(rng, 10))) for path in paths]
+    files.append(('LICENSE', stream.blob(b'Fixture licence text\n')))
+    commit = stream.commit('refs/heads/main', 'Initial import', files)
+    for n in range(1, args.commits):
+        changed = [(path, stream.blob(text(rng, rng.randint(1, 10)))) for path in rng.sample(paths, rng.randint(1, 3))]
+        commit = stream.commit('refs/heads/main', f'Change {n}', changed, parent=commit)
+    stream.close()
+    return {'trees': ['', directories[0]], 'files': ['LICENSE', paths[0]]}
+
+
+def build_huge_blob(repo_path, rng, args):
+    """A --blob-size binary blob and a --text-blob-size text file"""
+    stream = FastImport(repo_path)
+
+    def random_chunks(size):
+        remaining = size
+        while remaining:
+            n = min(WRITE_CHUNK, remaining)
+            remaining -= n
+            yield rng.randbytes(n)
+
+    def text_chunks(size):
+        remaining = size
+        while remaining:
+            chunk = text(rng, 2000)[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+    files = [
+        ('big/huge.bin', stream.streamed_blob(args.blob_size, random_chunks(args.blob_size))),
+        ('big/large.log', stream.streamed_blob(args.text_blob_size, text_chunks(args.text_blob_size))),
+        ('README.md', stream.blob(b'# huge-blob\n')),
+    ]
+    stream.commit('refs/heads/main', 'Add large files', files)
+    stream.close()
+    return {'trees': ['', 'big'], 'files': ['big/huge.bin', 'big/large.log']}
+
+
+def build_many_refs(repo_path, rng, args):
+    """--branches branches and --tags annotated tags spread over a short history"""
+    stream = FastImport(repo_path)
+    paths = [f'file{i:03d}.txt' for i in range(50)]
+    commit = stream.commit('refs/heads/main', 'Initial import',
+                           [(path, stream.blob(text(rng, 10))) for path in paths])
+    commits = [commit]
+    for n in range(1, 200):
+        commit = stream.commit('refs/heads/main', f'Change {n}',
+                               [(rng.choice(paths), stream.blob(text(rng, 5)))], parent=commit)
+        commits.append(commit)
+    for i in range(args.branches):
+        stream.branch(f'refs/heads/feature/{i:05d}', rng.choice(commits))
+    for i in range(args.tags):
+        stream.tag(f'v{i // 100}.{i % 100}.0', rng.choice(commits), f'Release {i}')
+    stream.close()
+    return {'trees': [''], 'files': [paths[0]]}
+
+
+BUILDERS = {
+    'wide-tree': build_wide_tree,
+    'long-history': build_long_history,
+    'huge-blob': build_huge_blob,
+    'many-refs': build_many_refs,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate reproducible pathological repositories')
+    parser.add_argument('output', help='directory for the <fixture>.git repositories and fixtures.json')
+    parser.add_argument('--only', default=','.join(FIXTURES), help=f'comma-separated subset of: {", ".join(FIXTURES)}')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--tree-entries', type=int, default=TREE_ENTRIES)
+    parser.add_argument('--commits', type=int, default=HISTORY_COMMITS)
+    parser.add_argument('--history-files', type=int, default=HISTORY_FILES)
+    parser.add_argument('--blob-size', type=parse_size, default=BLOB_SIZE, help='e.g. 2G, 64M')
+    parser.add_argument('--text-blob-size', type=parse_size, default=TEXT_BLOB_SIZE)
+    parser.add_argument('--branches', type=int, default=BRANCHES)
+    parser.add_argument('--tags', type=int, default=TAGS)
+    parser.add_argument('--force', action='store_true', help='replace fixtures that already exist')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name.strip() for name in args.only.split(',') if name.strip()]
+    unknown = [name for name in names if name not in BUILDERS]
+    if unknown:
+        print(f"Error: unknown fixtures: {', '.join(unknown)}")
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, 'fixtures.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    for name in names:
+        repo_path = os.path.join(args.output, name + '.git')
+        if os.path.exists(repo_path):
+            if not args.force:
+                print(f"{name}: already exists, skipping (use --force to rebuild)")
+                continue
+            shutil.rmtree(repo_path)
+        print(f"{name}: generating...")
+        sys.stdout.flush()
+        started = time.monotonic()
+        # One generator per fixture, so each is reproducible on its own
+        rng = random.Random(f'{args.seed}-{name}')
+        paths = BUILDERS[name](repo_path, rng, args)
+        head = subprocess.run(['git', '--git-dir', repo_path, 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+        manifest[name] = dict(paths, repo=name + '.git', branch='main', head=head, seed=args.seed,
+                              parameters={key: value for key, value in vars(args).items()
+                                          if key not in ('output', 'only', 'force')})
+        print(f"{name}: {head} in {time.monotonic() - started:.1f}s")
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Load-testing benchmark for git-server.py
+Starts the server on localhost against a generated fixture repository, drives
+each workload at a fixed concurrency and reports throughput, latency
+percentiles, peak RSS and CPU. Results are saved as JSON; comparing two runs
+fails on regressions.
+"""
+
+import os
+import sys
+import argparse
+import http.client
+import json
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+GIT_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'git-server.py')
+
+# Workloads, in the order they run; push goes last since it adds branches
+WORKLOADS = ('info_refs', 'browse', 'clone', 'fetch', 'push')
+
+# Fixture
+FIXTURE_SEED = 1
+FIXTURE_FILES = 1000        # files in the generated repository
+FIXTURE_DIRS = 40           # directories they are spread over
+FIXTURE_COMMITS = 200       # commits of history, each touching a few files
+FETCH_BEHIND = 20           # commits an incremental fetch has to bring in
+
+# Runs
+DURATION = 10               # seconds each workload runs
+CONCURRENCY = 8             # clients per workload
+RSS_SAMPLE_INTERVAL = 0.05  # seconds between RSS samples of the server process tree
+SERVER_START_TIMEOUT = 30
+
+# Comparison
+TOLERANCE = 0.10            # relative change that counts as a regression
+LATENCY_FLOOR = 0.001       # latency changes smaller than this (seconds) are noise
+ERROR_RATE_TOLERANCE = 0.01
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def git(*args, cwd=None, input=None):
+    """Run a git command quietly; returns its stdout"""
+    result = subprocess.run(
+        ['git', *args], cwd=cwd, input=input, capture_output=True,
+        env=dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {result.stderr.decode('utf-8', errors='ignore').strip()}")
+    return result.stdout
+
+
+def build_fixture(repo_path, seed=FIXTURE_SEED, files=FIXTURE_FILES, dirs=FIXTURE_DIRS, commits=FIXTURE_COMMITS):
+    """Create a bare repository with reproducible contents and history through git fast-import"""
+    rng = random.Random(seed)
+    paths = [f'dir{rng.randrange(dirs):03d}/file{i:05d}.txt' for i in range(files)]
+    paths.append('assets/large.bin')
+
+    def text_blob():
+        return ''.join(f'line {rng.randrange(10 ** 9)} of generated content\n' for _ in range(rng.randint(5, 200))).encode()
+
+    stream = []
+
+    def data(payload):
+        stream.append(b'data %d\n' % len(payload) + payload + b'\n')
+
+    timestamp = 1700000000
+    for n in range(commits):
+        stream.append(b'commit refs/heads/main\n')
+        stream.append(b'committer Bench <bench@example.com> %d +0000\n' % (timestamp + n * 60))
+        data(b'commit %d' % n)
+        if n == 0:
+            for path in paths[:-1]:
+                stream.append(f'M 100644 inline {path}\n'.encode())
+                data(text_blob())
+            stream.append(f'M 100644 inline {paths[-1]}\n'.encode())
+            data(rng.randbytes(1024 * 1024))
+        else:
+            for path in rng.sample(paths[:-1], 3):
+                stream.append(f'M 100644 inline {path}\n'.encode())
+                data(text_blob())
+
+    git('init', '-q', '--bare', '--initial-branch=main', repo_path)
+    git('fast-import', '--quiet', cwd=repo_path, input=b''.join(stream))
+    # git-http-backend refuses unauthenticated pushes unless this is set
+    git('config', 'http.receivepack', 'true', cwd=repo_path)
+    git('update-server-info', cwd=repo_path)
+
+
+def repository_paths(repo_path, branch):
+    """(directories, files) at the tip of branch"""
+    listing = git('ls-tree', '-r', '-t', '--format=%(objecttype) %(path)', branch, cwd=repo_path).decode()
+    directories, files = [''], []
+    for line in listing.splitlines():
+        obj_type, path = line.split(' ', 1)
+        (directories if obj_type == 'tree' else files).append(path)
+    return directories, files
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree(root_pid):
+    """root_pid and all of its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, ()))
+    return pids
+
+
+def tree_cpu_seconds(root_pid):
+    """User+system CPU of the process tree, including children it has reaped"""
+    ticks = 0
+    for pid in process_tree(root_pid):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # utime, stime, cutime, cstime
+        ticks += sum(int(value) for value in fields[11:15])
+    return ticks / CLOCK_TICKS
+
+
+def tree_rss_bytes(root_pid):
+    total = 0
+    for pid in process_tree(root_pid):
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def vm_hwm_bytes(pid):
+    """Peak resident set size of one process, from /proc/<pid>/status"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RSSSampler:
+    """Tracks the peak RSS of a process tree while a workload runs"""
+
+    def __init__(self, root_pid):
+        self.root_pid = root_pid
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss_bytes(self.root_pid))
+            self._stop.wait(RSS_SAMPLE_INTERVAL)
+
+
+class BenchServer:
+    """git-server.py running in a child process on a free localhost port"""
+
+    def __init__(self, repo_dir, cache_dir, server_args):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [sys.executable, GIT_SERVER, '--repo-dir', repo_dir, '--port', str(self.port),
+             '--cache-dir', cache_dir, *server_args],
+            stdout=self.log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"git-server.py exited during startup:\n{self.output()}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                conn.request('GET', '/')
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("git-server.py did not start listening")
+                time.sleep(0.1)
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode('utf-8', errors='replace')
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class Workloads:
+    """One method per workload; each call performs one timed operation.
+
+    setup_<name>(client) prepares per-client state outside the timed part.
+    Operations raise on failure.
+    """
+
+    def __init__(self, server, repo_name, repo_path, branch, work_dir, seed):
+        self.server = server
+        self.repo_name = repo_name
+        self.repo_url = f'{server.url}/{repo_name}.git'
+        self.branch = branch
+        self.work_dir = work_dir
+        self.directories, self.files = repository_paths(repo_path, branch)
+        self.seed = seed
+        self._fetch_template = None
+        self._template_lock = threading.Lock()
+
+    def new_client(self, workload, index):
+        client = {
+            'rng': random.Random(f'{self.seed}-{workload}-{index}'),
+            'dir': tempfile.mkdtemp(prefix=f'{workload}-{index}-', dir=self.work_dir),
+            'index': index,
+        }
+        setup = getattr(self, f'setup_{workload}', None)
+        if setup is not None:
+            setup(client)
+        return client
+
+    def http_get(self, client, path, headers=None):
+        conn = client.get('conn')
+        if conn is None:
+            conn = client['conn'] = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=120)
+        try:
+            conn.request('GET', path, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            client['conn'] = None
+            raise
+        if response.will_close:
+            conn.close()
+            client['conn'] = None
+        if response.status >= 400:
+            raise RuntimeError(f"GET {path}: {response.status}")
+
+    def info_refs(self, client):
+        # What Jenkins polling asks for
+        self.http_get(client, f'/{self.repo_name}.git/info/refs?service=git-upload-pack')
+
+    def browse(self, client):
+        rng = client['rng']
+        if rng.random() < 0.5:
+            path = rng.choice(self.directories)
+            url = f'/{self.repo_name}/tree/{self.branch}/{path}'.rstrip('/')
+        else:
+            url = f'/{self.repo_name}/blob/{self.branch}/{rng.choice(self.files)}'
+        self.http_get(client, url, {'Accept-Encoding': 'gzip'})
+
+    def clone(self, client):
+        target = os.path.join(client['dir'], 'clone')
+        try:
+            git('clone', '-q', '--no-checkout', self.repo_url, target)
+        finally:
+            shutil.rmtree(target, ignore_errors=True)
+
+    def setup_fetch(self, client):
+        with self._template_lock:
+            if self._fetch_template is None:
+                # A clone FETCH_BEHIND commits behind, with the newer objects pruned away
+                template = os.path.join(self.work_dir, 'fetch-template.git')
+                git('clone', '-q', '--bare', self.repo_url, template)
+                git('update-ref', f'refs/heads/{self.branch}', f'{self.branch}~{FETCH_BEHIND}', cwd=template)
+                git('reflog', 'expire', '--expire=now', '--all', cwd=template)
+                git('gc', '-q', '--prune=now', cwd=template)
+                self._fetch_template = template
+        client['template'] = self._fetch_template
+
+    def fetch(self, client):
+        target = os.path.join(client['dir'], 'fetch.git')
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(client['template'], target, symlinks=True)
+        started = time.perf_counter()
+        git('fetch', '-q', self.repo_url, f'{self.branch}:{self.branch}', cwd=target)
+        client['elapsed'] = time.perf_counter() - started
+
+    def setup_push(self, client):
+        worktree = os.path.join(client['dir'], 'push')
+        git('clone', '-q', self.repo_url, worktree)
+        git('config', 'user.name', 'Bench', cwd=worktree)
+        git('config', 'user.email', 'bench@example.com', cwd=worktree)
+        client['worktree'] = worktree
+        client['ref'] = f'refs/heads/bench/push-{client["index"]}'
+        client['pushes'] = 0
+
+    def push(self, client):
+        worktree = client['worktree']
+        client['pushes'] += 1
+        with open(os.path.join(worktree, f'bench-{client["index"]}.txt'), 'a') as f:
+            f.write(f'push {client["pushes"]} {client["rng"].random()}\n')
+        git('add', '-A', cwd=worktree)
+        git('commit', '-q', '-m', f'bench push {client["pushes"]}', cwd=worktree)
+        started = time.perf_counter()
+        git('push', '-q', 'origin', f'HEAD:{client["ref"]}', cwd=worktree)
+        client['elapsed'] = time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_workload(workloads, name, concurrency, duration, server_pid):
+    """Drive one workload with concurrency clients for duration seconds"""
+    clients = [workloads.new_client(name, i) for i in range(concurrency)]
+    operation = getattr(workloads, name)
+    latencies = [[] for _ in clients]
+    errors = [0] * concurrency
+    first_error = []
+    start_barrier = threading.Barrier(concurrency + 1)
+    deadline = None
+
+    def drive(i):
+        client = clients[i]
+        start_barrier.wait()
+        while time.monotonic() < deadline:
+            client.pop('elapsed', None)
+            started = time.perf_counter()
+            try:
+                operation(client)
+            except Exception as e:
+                errors[i] += 1
+                if not first_error:
+                    first_error.append(str(e))
+                continue
+            # Workloads with untimed preparation report their own elapsed time
+            latencies[i].append(client.get('elapsed', time.perf_counter() - started))
+
+    threads = [threading.Thread(target=drive, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    with RSSSampler(server_pid) as rss:
+        cpu_before = tree_cpu_seconds(server_pid)
+        started = time.monotonic()
+        deadline = started + duration
+        start_barrier.wait()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        cpu = tree_cpu_seconds(server_pid) - cpu_before
+
+    for client in clients:
+        if client.get('conn') is not None:
+            client['conn'].close()
+        shutil.rmtree(client['dir'], ignore_errors=True)
+
+    samples = sorted(latency for per_client in latencies for latency in per_client)
+    operations = len(samples)
+    result = {
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'operations': operations,
+        'errors': sum(errors),
+        'error_rate': sum(errors) / max(operations + sum(errors), 1),
+        'throughput': operations / elapsed if elapsed else 0,
+        'latency': {
+            'mean': sum(samples) / operations if operations else None,
+            'p50': percentile(samples, 0.50),
+            'p95': percentile(samples, 0.95),
+            'p99': percentile(samples, 0.99),
+            'max': samples[-1] if samples else None,
+        },
+        'peak_rss_bytes': rss.peak,
+        'cpu_seconds': round(cpu, 3),
+        'cpu_per_operation': cpu / operations if operations else None,
+    }
+    if first_error:
+        result['first_error'] = first_error[0]
+    return result
+
+
+def format_seconds(value):
+    if value is None:
+        return '-'
+    return f'{value * 1000:.1f}ms' if value < 1 else f'{value:.2f}s'
+
+
+def print_results(results):
+    print(f"{'workload':<10} {'clients':>7} {'ops':>7} {'errors':>6} {'ops/s':>9} "
+          f"{'p50':>9} {'p95':>9} {'p99':>9} {'peak RSS':>10} {'CPU':>8}")
+    for name, r in results['workloads'].items():
+        latency = r['latency']
+        print(f"{name:<10} {r['concurrency']:>7} {r['operations']:>7} {r['errors']:>6} {r['throughput']:>9.1f} "
+              f"{format_seconds(latency['p50']):>9} {format_seconds(latency['p95']):>9} "
+              f"{format_seconds(latency['p99']):>9} {r['peak_rss_bytes'] / 2 ** 20:>8.1f}MB {r['cpu_seconds']:>7.2f}s")
+        if r.get('first_error'):
+            print(f"           first error: {r['first_error']}")
+
+
+def compare(baseline, current, tolerance=TOLERANCE):
+    """Print the change per workload and metric; returns the regressions found"""
+    regressions = []
+
+    def check(workload, metric, old, new, higher_is_better, floor=0.0):
+        if old is None or new is None:
+            return
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance and abs(new - old) > floor
+        flag = 'REGRESSION' if regressed else ''
+        print(f"  {workload:<10} {metric:<18} {old:>12.4g} -> {new:<12.4g} {change:+7.1%} {flag}")
+        if regressed:
+            regressions.append(f"{workload} {metric} {change:+.1%}")
+
+    for workload, new in current['workloads'].items():
+        old = baseline['workloads'].get(workload)
+        if old is None:
+            print(f"  {workload:<10} not in the baseline")
+            continue
+        if old['concurrency'] != new['concurrency']:
+            print(f"  {workload:<10} ran with {old['concurrency']} clients before, {new['concurrency']} now")
+        check(workload, 'throughput', old['throughput'], new['throughput'], True)
+        for quantile in ('p50', 'p95', 'p99'):
+            check(workload, f'latency {quantile}', old['latency'][quantile], new['latency'][quantile], False,
+                  LATENCY_FLOOR)
+        check(workload, 'peak RSS', old['peak_rss_bytes'], new['peak_rss_bytes'], False)
+        check(workload, 'CPU per operation', old['cpu_per_operation'], new['cpu_per_operation'], False)
+        if new['error_rate'] - old['error_rate'] > ERROR_RATE_TOLERANCE:
+            print(f"  {workload:<10} error rate {old['error_rate']:.1%} -> {new['error_rate']:.1%} REGRESSION")
+            regressions.append(f"{workload} error rate {new['error_rate']:.1%}")
+    return regressions
+
+
+def parse_concurrency(values):
+    """--concurrency 8 and/or --concurrency clone=2 into (default, {workload: n})"""
+    default, per_workload = CONCURRENCY, {}
+    for value in values or ():
+        name, sep, count = value.rpartition('=')
+        if sep:
+            if name not in WORKLOADS:
+                raise SystemExit(f"Unknown workload in --concurrency: {name}")
+            per_workload[name] = int(count)
+        else:
+            default = int(count)
+    return default, per_workload
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark git-server.py on localhost')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help=f'comma-separated subset of: {", ".join(WORKLOADS)}')
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds per workload')
+    parser.add_argument('--concurrency', action='append', metavar='N|WORKLOAD=N',
+                        help=f'clients per workload (default {CONCURRENCY}); repeat as clone=2 to override one')
+    parser.add_argument('--repo-dir', help='benchmark existing repositories instead of a generated fixture '
+                        '(the push workload needs http.receivepack=true in them)')
+    parser.add_argument('--repo', help='repository under --repo-dir to use (default: the first one)')
+    parser.add_argument('--seed', type=int, default=FIXTURE_SEED)
+    parser.add_argument('--server-arg', action='append', default=[], metavar='ARG',
+                        help='extra git-server.py argument, e.g. --server-arg=--engine=asyncio (repeatable)')
+    parser.add_argument('--output', metavar='JSON', help='write the results here')
+    parser.add_argument('--baseline', metavar='JSON', help='compare this run with an earlier one')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULT'),
+                        help='compare two saved runs without benchmarking')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='relative change that counts as a regression (default %(default)s)')
+    parser.add_argument('--keep', action='store_true', help='keep the work directory')
+    return parser.parse_args(argv)
+
+
+def report_regressions(baseline_path, current, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path}:")
+    regressions = compare(baseline, current, tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): " + '; '.join(regressions))
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return report_regressions(args.compare[0], current, args.tolerance)
+
+    names = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        print(f"Error: unknown workloads: {', '.join(unknown)}")
+        return 2
+    default_concurrency, concurrency = parse_concurrency(args.concurrency)
+
+    work_dir = tempfile.mkdtemp(prefix='git-server-bench-')
+    server = None
+    try:
+        if args.repo_dir:
+            repo_dir = os.path.abspath(args.repo_dir)
+            repo_name = args.repo or sorted(d for d in os.listdir(repo_dir) if d.endswith('.git'))[0]
+            repo_name = repo_name[:-len('.git')] if repo_name.endswith('.git') else repo_name
+            fixture = {'repo_dir': repo_dir, 'repo': repo_name}
+        else:
+            repo_dir = os.path.join(work_dir, 'repositories')
+            repo_name = 'bench'
+            print(f"Generating fixture repository (seed {args.seed})...")
+            build_fixture(os.path.join(repo_dir, 'bench.git'), seed=args.seed)
+            fixture = {'seed': args.seed, 'files': FIXTURE_FILES, 'dirs': FIXTURE_DIRS, 'commits': FIXTURE_COMMITS}
+        repo_path = os.path.join(repo_dir, repo_name + '.git')
+        branch = git('symbolic-ref', '--short', 'HEAD', cwd=repo_path).decode().strip()
+
+        server = BenchServer(repo_dir, os.path.join(work_dir, 'cache'), args.server_arg)
+        workloads = Workloads(server, repo_name, repo_path, branch, work_dir, args.seed)
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'host': platform.node(),
+                'cpus': os.cpu_count(),
+                'python': platform.python_version(),
+                'git': git('--version').decode().strip(),
+                'server_args': args.server_arg,
+                'duration': args.duration,
+                'fixture': fixture,
+            },
+            'workloads': {},
+        }
+        for name in names:
+            clients = concurrency.get(name, default_concurrency)
+            print(f"Running {name} with {clients} clients for {args.duration:g}s...")
+            results['workloads'][name] = run_workload(workloads, name, clients, args.duration, server.process.pid)
+        results['meta']['server_vm_hwm_bytes'] = vm_hwm_bytes(server.process.pid)
+    finally:
+        if server is not None:
+            server.stop()
+        if args.keep:
+            print(f"Work directory kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        return report_regressions(args.baseline, results, args.tolerance)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for git-server.py's browser helpers
+Times get_file_tree, get_file_content, get_file_info, get_repo_branches,
+render_repo_browser and render_file_view directly, without HTTP, against the
+repositories made by git-fixture-repos.py.
+"""
+
+import os
+import sys
+import argparse
+import importlib.util
+import json
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+GIT_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'git-server.py')
+
+HELPERS = ('get_file_tree', 'get_file_content', 'get_file_info', 'get_repo_branches',
+           'render_repo_browser', 'render_file_view')
+
+REPEAT = 5
+WARMUP = 1
+INDEX_BUILD_TIMEOUT = 3600      # seconds to wait for a last-commit index build
+
+# Comparison
+TOLERANCE = 0.10                # relative slowdown of the median that counts as a regression
+FLOOR = 0.0001                  # slowdowns smaller than this (seconds) are noise
+
+
+def load_git_server():
+    """Import git-server.py (its name is not a valid module name)"""
+    spec = importlib.util.spec_from_file_location('git_server', GIT_SERVER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_fixtures(fixture_dir):
+    """Manifest of the fixtures, or a minimal one for repositories made some other way"""
+    manifest_path = os.path.join(fixture_dir, 'fixtures.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    fixtures = {}
+    for repo in sorted(d for d in os.listdir(fixture_dir) if d.endswith('.git')):
+        repo_path = os.path.join(fixture_dir, repo)
+        branch = subprocess.run(['git', '--git-dir', repo_path, 'symbolic-ref', '--short', 'HEAD'],
+                                capture_output=True, text=True).stdout.strip()
+        listing = subprocess.run(['git', '--git-dir', repo_path, 'ls-tree', '--format=%(objecttype) %(path)', branch],
+                                 capture_output=True, text=True).stdout.split('\n')
+        files = [line.split(' ', 1)[1] for line in listing if line.startswith('blob ')][:1]
+        fixtures[repo[:-len('.git')]] = {'repo': repo, 'branch': branch, 'trees': [''], 'files': files}
+    return fixtures
+
+
+def cases(fixtures, helpers):
+    """(name, fixture, helper, call arguments) for every helper and notable path"""
+    for fixture_name, fixture in fixtures.items():
+        branch = fixture['branch']
+        for helper in helpers:
+            if helper == 'get_repo_branches':
+                yield f'{helper}[{fixture_name}]', fixture, helper, ()
+            elif helper in ('get_file_tree', 'render_repo_browser'):
+                for tree in fixture['trees']:
+                    args = (branch, tree) if helper == 'get_file_tree' else (fixture_name, branch, tree)
+                    yield f'{helper}[{fixture_name}:{tree or "/"}]', fixture, helper, args
+            else:
+                for path in fixture['files']:
+                    args = (fixture_name, branch, path) if helper == 'render_file_view' else (branch, path)
+                    yield f'{helper}[{fixture_name}:{path}]', fixture, helper, args
+
+
+def call(handler, helper, repo_path, args):
+    """Run one helper; rendered pages are joined so the generators actually run"""
+    method = getattr(handler, helper)
+    if helper.startswith('render_'):
+        name, *rest = args
+        return ''.join(method(name, repo_path, *rest))
+    return method(repo_path, *args)
+
+
+def wait_for_index(server, repo_path, branch):
+    """Build the last-commit index for branch; returns how long it took"""
+    handler = server.GitHTTPRequestHandler.__new__(server.GitHTTPRequestHandler)
+    commit = handler.resolve_commit(repo_path, branch)
+    started = time.perf_counter()
+    while server.last_commit_index.get(repo_path, branch, commit) is None:
+        if time.perf_counter() - started > INDEX_BUILD_TIMEOUT:
+            raise RuntimeError(f"last-commit index for {repo_path} not built in time")
+        time.sleep(0.05)
+    return time.perf_counter() - started
+
+
+def reset_caches(server):
+    """Drop the in-memory caches so every call starts cold (cat-file workers stay up)"""
+    server.object_cache = server.LRUCache(server.OBJECT_CACHE_BYTES)
+    server.page_cache = server.LRUCache(server.PAGE_CACHE_BYTES)
+    server.ref_cache = server.RefCache()
+
+
+def run(args):
+    server = load_git_server()
+    fixture_dir = os.path.abspath(args.fixture_dir)
+    server.GIT_REPO_DIR = fixture_dir
+    # A fresh cache directory, so last-commit indexes are built (and timed) from scratch
+    server.CACHE_DIR = tempfile.mkdtemp(prefix='git-server-microbench-')
+
+    fixtures = load_fixtures(fixture_dir)
+    if args.fixtures:
+        wanted = args.fixtures.split(',')
+        fixtures = {name: fixture for name, fixture in fixtures.items() if name in wanted}
+    helpers = args.only.split(',') if args.only else HELPERS
+    handler = server.GitHTTPRequestHandler.__new__(server.GitHTTPRequestHandler)
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': sys.version.split()[0],
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'cold': args.cold,
+            'fixtures': {name: fixture.get('head') for name, fixture in fixtures.items()},
+        },
+        'cases': {},
+    }
+
+    print(f"{'case':<60} {'median':>10} {'min':>10} {'max':>10}")
+    for name, fixture in fixtures.items():
+        repo_path = os.path.join(fixture_dir, fixture['repo'])
+        seconds = wait_for_index(server, repo_path, fixture['branch'])
+        results['cases'][f'last_commit_index_build[{name}]'] = {'median': seconds, 'min': seconds, 'max': seconds,
+                                                                 'samples': [seconds]}
+        print(f"{f'last_commit_index_build[{name}]':<60} {seconds:>9.4f}s")
+
+    try:
+        for name, fixture, helper, call_args in cases(fixtures, helpers):
+            repo_path = os.path.join(fixture_dir, fixture['repo'])
+            for _ in range(args.warmup):
+                call(handler, helper, repo_path, call_args)
+            samples = []
+            for _ in range(args.repeat):
+                if args.cold:
+                    reset_caches(server)
+                started = time.perf_counter()
+                call(handler, helper, repo_path, call_args)
+                samples.append(time.perf_counter() - started)
+            result = {'median': statistics.median(samples), 'min': min(samples), 'max': max(samples),
+                      'samples': samples}
+            results['cases'][name] = result
+            print(f"{name:<60} {result['median']:>9.4f}s {result['min']:>9.4f}s {result['max']:>9.4f}s")
+            sys.stdout.flush()
+    finally:
+        server.catfile_pool.close()
+        shutil.rmtree(server.CACHE_DIR, ignore_errors=True)
+    return results
+
+
+def compare(baseline, current, tolerance=TOLERANCE):
+    """Print the change in median per case; returns the regressions found"""
+    regressions = []
+    if baseline['meta'].get('cold') != current['meta'].get('cold'):
+        print("  (one run used --cold and the other did not)")
+    for name, new in current['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            continue
+        change = (new['median'] - old['median']) / old['median'] if old['median'] else 0.0
+        regressed = change > tolerance and new['median'] - old['median'] > FLOOR
+        print(f"  {name:<60} {old['median']:>9.4f}s -> {new['median']:>9.4f}s {change:+8.1%}"
+              f"{' REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(f"{name} {change:+.1%}")
+    return regressions
+
+
+def report_regressions(baseline_path, current, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path}:")
+    regressions = compare(baseline, current, tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): " + '; '.join(regressions))
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark git-server.py's browser helpers")
+    parser.add_argument('fixture_dir', nargs='?', help='output directory of git-fixture-repos.py')
+    parser.add_argument('--fixtures', help='comma-separated fixtures to run (default: all)')
+    parser.add_argument('--only', help=f'comma-separated helpers to time (default: {", ".join(HELPERS)})')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed calls per case')
+    parser.add_argument('--warmup', type=int, default=WARMUP, help='untimed calls per case first')
+    parser.add_argument('--cold', action='store_true', help='clear the object, page and ref caches before each call')
+    parser.add_argument('--output', metavar='JSON', help='write the results here')
+    parser.add_argument('--baseline', metavar='JSON', help='compare this run with an earlier one')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULT'),
+                        help='compare two saved runs without benchmarking')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='relative slowdown that counts as a regression (default %(default)s)')
+    args = parser.parse_args(argv)
+    if not args.compare and not args.fixture_dir:
+        parser.error('fixture_dir is required unless --compare is given')
+    unknown = [helper for helper in (args.only or '').split(',') if helper and helper not in HELPERS]
+    if unknown:
+        parser.error(f"unknown helpers: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return report_regressions(args.compare[0], current, args.tolerance)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        return report_regressions(args.baseline, results, args.tolerance)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,109 +6,2717 @@ Exposes git repositories via HTTP for access through ngrok
 
 import os
 import sys
+import asyncio
+import concurrent.futures
+import cProfile
 import subprocess
 import http.server
 import cgi
+import email.utils
 import html
+import io
 import base64
+import hashlib
+import json
+import mimetypes
+import re
+import stat
+import argparse
+import bisect
+import fcntl
+import functools
+import inspect
+import itertools
+import queue
+import random
+import selectors
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+from collections import OrderedDict
 from urllib.parse import urlparse, unquote, parse_qs
 
+try:
+    import zstandard
+except ImportError:  # optional; gzip is always available
+    zstandard = None
+
 # Configuration
 GIT_REPO_DIR = "/home/sylaw/git/repositories"
 GIT_HTTP_BACKEND = "/usr/lib/git-core/git-http-backend"
 SERVER_PORT = 8080
 
+# Concurrency
+MAX_WORKERS = 32            # worker threads serving connections (0 = serve one at a time)
+MAX_QUEUE_DEPTH = 64        # accepted connections waiting for a worker before we answer 503
+MAX_PACK_PER_REPO = 8       # concurrent upload-pack/receive-pack runs per repository
+REPO_SLOT_TIMEOUT = 120     # seconds a pack request waits for a repository slot
+
+# Admission control
+PACK_CONCURRENCY = 8        # upload-pack/receive-pack runs admitted at once across all repositories (0 = no limit)
+PACK_QUEUE_DEPTH = 16       # pack requests allowed to wait for admission before answering 503
+PACK_QUEUE_TIMEOUT = 30     # seconds a pack request may wait for admission
+BROWSE_CONCURRENCY = 16     # browser, file and ref requests admitted at once (0 = no limit)
+BROWSE_QUEUE_DEPTH = 64
+BROWSE_QUEUE_TIMEOUT = 5
+TRANSFER_CONCURRENCY = 16   # pack file and clone bundle downloads admitted at once (0 = no limit)
+TRANSFER_QUEUE_DEPTH = 32
+TRANSFER_QUEUE_TIMEOUT = 30
+
+# Connections
+KEEPALIVE_TIMEOUT = 15              # seconds an idle keep-alive connection waits for its next request
+REQUEST_TIMEOUT = 120               # socket timeout while a request is being read or answered
+MAX_REQUESTS_PER_CONNECTION = 100   # requests served on one connection before it is closed
+MAX_IDLE_CONNECTIONS = 512          # idle keep-alive connections watched off the worker pool; more are closed
+
+# Streaming
+STREAM_CHUNK_SIZE = 64 * 1024   # bytes copied per read between client and git-http-backend
+STDERR_TAIL_SIZE = 64 * 1024    # bytes of git-http-backend stderr kept for error reports
+MAX_REQUEST_BODY = 0            # decoded bytes accepted in one request body (0 = no limit)
+
+# Clone storms
+COALESCE_MAX_BODY = 64 * 1024           # identical upload-pack bodies up to this size share one backend run (0 = off)
+FANOUT_MEMORY_BYTES = 8 * 1024 * 1024   # shared output kept in memory before spilling to a temporary file
+
+# Clone bundles
+BUNDLE_URIS = True          # keep a bundle per repository and advertise it to protocol v2 clients
+BUNDLE_DEBOUNCE = 60        # seconds after the last push before the repository's bundle is rebuilt
+BUNDLE_MAX_DELAY = 600      # a rebuild waits at most this long after the first push, however busy
+
+# Processes
+SHUTDOWN_GRACE = 30         # seconds in-flight requests get to finish after SIGTERM
+WORKER_RESTART_DELAY = 1    # seconds before a crashed worker process is replaced (doubles while it keeps crashing)
+
+# Maintenance
+MAINTENANCE = True              # repack and index repositories in the background after pushes
+MAINTENANCE_INTERVAL = 30       # seconds between looks for repositories due for maintenance
+MAINTENANCE_IDLE = 120          # seconds without git traffic before a repository is maintained
+MAINTENANCE_NICE = 19           # niceness of maintenance runs
+MAINTENANCE_PACK_THREADS = 1    # cores a maintenance repack may use
+
+# Metrics
+METRICS = True      # serve Prometheus metrics at /metrics
+METRICS_SHARE_INTERVAL = 1  # seconds between snapshots each --workers process writes for the others' scrapes
+# Histogram bucket bounds in seconds; clones of big repositories can take minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Tracing
+SLOW_REQUEST_SECONDS = 0    # requests slower than this go to the slow log with their span breakdown (0 = off)
+SLOW_LOG = None             # slow log file; stderr when None
+PROFILE_SAMPLE_RATE = 0     # fraction of requests run under cProfile (0 = off)
+PROFILE_DIR = None          # profile dumps; defaults to <cache dir>/profiles
+PROFILE_KEEP = 100          # newest profile dumps kept
+
+# Object access
+CATFILE_POOL_SIZE = 4           # live `git cat-file` workers per repository and mode
+CATFILE_IDLE_TIMEOUT = 300      # seconds an unused worker is kept before it is stopped
+
+# Caches
+OBJECT_CACHE_BYTES = 64 * 1024 * 1024   # memory budget for cached tree listings and blobs
+PAGE_CACHE_BYTES = 32 * 1024 * 1024     # memory budget for rendered tree/blob pages
+TREE_ENTRY_BYTES = 256                  # memory a parsed tree entry takes besides its name: tuple, mode and sha strings
+CACHE_DIR = None                        # on-disk indexes; defaults to <GIT_REPO_DIR>/.git-server-cache
+LAST_COMMIT_INDEX_ENTRIES = 64          # branch last-commit indexes kept in memory
+LAST_COMMIT_INDEX_BUILDS = 2            # initial index builds (full history walks) running at once
+
+# Blob views
+PREVIEW_BYTES = 256 * 1024      # bytes of a file shown per page in the HTML view
+BINARY_SNIFF_BYTES = 8000       # a NUL byte in this prefix marks a blob as binary (git's own heuristic)
+SNIFF_FULL_READ_BYTES = 64 * 1024   # blobs up to this size are read whole (and cached) when sniffed
+
+# Compression
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Text responses worth compressing; pack data is already zlib-compressed
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/x-git-upload-pack-advertisement',
+    'application/x-git-receive-pack-advertisement',
+)
+
+# Dumb-HTTP files served straight from disk: (path in repository, content type, immutable)
+DUMB_HTTP_FILES = (
+    (re.compile(r'HEAD'), 'text/plain', False),
+    (re.compile(r'objects/info/(?:alternates|http-alternates|packs)'), 'text/plain; charset=utf-8', False),
+    (re.compile(r'objects/[0-9a-f]{2}/[0-9a-f]{38}'), 'application/x-git-loose-object', True),
+    (re.compile(r'objects/pack/pack-[0-9a-f]{40}\.pack'), 'application/x-git-packed-objects', True),
+    (re.compile(r'objects/pack/pack-[0-9a-f]{40}\.idx'), 'application/x-git-packed-objects-toc', True),
+)
+
+
+class Metrics:
+    """Counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Families are declared up front with define(); series within a family are
+    keyed by their labels. Values that already live elsewhere (cache stats,
+    admission budgets) are passed to collect() at scrape time instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = OrderedDict()  # name -> (kind, help, buckets, {labels: value})
+
+    def define(self, kind, name, help, buckets=None):
+        self._families[name] = (kind, help, buckets, {})
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._families[name][3]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        _, _, buckets, series = self._families[name]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = series.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                entry = series[key] = [0] * (len(buckets) + 1) + [0.0]
+            entry[bisect.bisect_left(buckets, value)] += 1
+            entry[-1] += value
+
+    def collect(self, samples=()):
+        """{name: {labels: value}} for every family; samples are extra (name, labels, value) for declared families"""
+        values = {}
+        with self._lock:
+            for name, (_, _, _, series) in self._families.items():
+                values[name] = {key: list(value) if isinstance(value, list) else value
+                                for key, value in series.items()}
+        for name, labels, value in samples:
+            values[name][tuple(sorted(labels.items()))] = value
+        return values
+
+    def merge(self, target, values, gauges=True):
+        """Add collect() output from another process into target; its gauges only if gauges is set"""
+        for name, series in values.items():
+            if name not in self._families:
+                continue
+            kind = self._families[name][0]
+            if kind == 'gauge' and not gauges:
+                continue
+            merged = target.setdefault(name, {})
+            for key, value in series.items():
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = list(value) if kind == 'histogram' else value
+                elif kind == 'histogram':
+                    merged[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = current + value
+        return target
+
+    def render(self, values):
+        """The exposition text for collect() output"""
+        lines = []
+        for name, (kind, help, buckets, _) in self._families.items():
+            series = values.get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in series.items():
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(key)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{name}_bucket{format_labels(key + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(key)} {value[-1]}')
+                lines.append(f'{name}_count{format_labels(key)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(key):
+    """Render a tuple of (label, value) pairs as {label="value",...}"""
+    if not key:
+        return ''
+    pairs = []
+    for label, value in key:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{label}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+metrics = Metrics()
+metrics.define('counter', 'git_http_requests_total', 'HTTP requests answered, by route and status code')
+metrics.define('histogram', 'git_http_request_duration_seconds',
+               'Time from request line to the end of the response, by route', LATENCY_BUCKETS)
+metrics.define('gauge', 'git_http_requests_in_flight', 'Requests being served')
+metrics.define('counter', 'git_http_request_body_bytes_total', 'Request body bytes received, by route')
+metrics.define('counter', 'git_http_response_bytes_total', 'Response bytes sent, headers included, by route')
+metrics.define('counter', 'git_processes_started_total', 'Subprocesses started, by git command')
+metrics.define('histogram', 'git_process_duration_seconds', 'Subprocess lifetimes, by git command', LATENCY_BUCKETS)
+metrics.define('counter', 'git_http_cache_hits_total', 'Cache lookups answered from memory, by cache')
+metrics.define('counter', 'git_http_cache_misses_total', 'Cache lookups that missed, by cache')
+metrics.define('counter', 'git_http_cache_evictions_total', 'Entries evicted to stay within budget, by cache')
+metrics.define('gauge', 'git_http_cache_bytes', 'Bytes held, by cache')
+metrics.define('gauge', 'git_http_cache_hit_ratio', 'Hits over lookups since start, by cache')
+metrics.define('counter', 'git_upload_pack_flights_started_total', 'upload-pack backend runs started for coalescable requests')
+metrics.define('counter', 'git_upload_pack_flights_joined_total', 'upload-pack requests served from a run already in flight')
+metrics.define('gauge', 'git_http_admission_active', 'Requests holding an admission slot, by budget')
+metrics.define('gauge', 'git_http_admission_waiting', 'Requests queued for an admission slot, by budget')
+metrics.define('counter', 'git_http_admission_shed_total', 'Requests answered 503 by admission control, by budget')
+
+
+class SharedMetrics:
+    """Adds up /metrics across --workers processes through snapshot files.
+
+    Each worker writes its collect() output to <directory>/<pid>.json every
+    METRICS_SHARE_INTERVAL seconds, and a scrape, whichever worker it lands
+    on, sums its own live values with every other worker's snapshot. When a
+    worker exits, the supervisor folds its counters and histograms into
+    retired.json, so totals never go backwards; its gauges are dropped.
+    Snapshots also carry each worker's repository maintenance state, for the
+    one worker that runs maintenance for all of them.
+    """
+
+    RETIRED = 'retired.json'
+
+    def __init__(self):
+        self.directory = None
+
+    def enable(self, directory):
+        self.directory = directory
+
+    def start(self, collect):
+        """Publish collect() periodically from this worker"""
+        if self.directory is None:
+            return
+        
+        def loop():
+            while True:
+                self.publish(collect())
+                time.sleep(METRICS_SHARE_INTERVAL)
+        
+        threading.Thread(target=loop, name='metrics-share', daemon=True).start()
+
+    def publish(self, values):
+        if self.directory is not None:
+            self._write(os.path.join(self.directory, f'{os.getpid()}.json'),
+                        {'values': self._encode(values), 'maintenance': repo_maintenance.shared_state()})
+
+    def worker_snapshots(self):
+        """{pid: latest snapshot} of every other live worker"""
+        if self.directory is None:
+            return {}
+        retired = self._read(os.path.join(self.directory, self.RETIRED)) or {'pids': []}
+        skip = {str(os.getpid())} | {str(pid) for pid in retired['pids']}
+        snapshots = {}
+        for filename in os.listdir(self.directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != '.json' or not pid.isdigit() or pid in skip:
+                continue
+            snapshot = self._read(os.path.join(self.directory, filename))
+            if snapshot is not None:
+                snapshots[int(pid)] = snapshot
+        return snapshots
+
+    def others_pack_active(self):
+        """Pack requests other workers were running at their last snapshot"""
+        key = (('budget', 'pack'),)
+        return sum(self._decode(snapshot['values']).get('git_http_admission_active', {}).get(key, 0)
+                   for snapshot in self.worker_snapshots().values())
+
+    def maintenance_states(self):
+        """{pid: RepoMaintenance.shared_state()} of every other live worker"""
+        return {pid: snapshot.get('maintenance', {}) for pid, snapshot in self.worker_snapshots().items()}
+
+    def gather(self, own):
+        """This worker's values (own) plus the latest snapshot of every other worker, live or retired"""
+        if self.directory is None:
+            return own
+        # Publishing first keeps every file, and so the sum, from going backwards
+        # between scrapes answered by different workers
+        self.publish(own)
+        retired = self._read(os.path.join(self.directory, self.RETIRED)) or {'values': {}}
+        metrics.merge(own, self._decode(retired['values']))
+        for snapshot in self.worker_snapshots().values():
+            metrics.merge(own, self._decode(snapshot['values']))
+        return own
+
+    def retire(self, pid):
+        """Fold an exited worker's counters into the retired totals (supervisor only)"""
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f'{pid}.json')
+        snapshot = self._read(path)
+        if snapshot is not None:
+            retired_path = os.path.join(self.directory, self.RETIRED)
+            retired = self._read(retired_path) or {'pids': [], 'values': {}}
+            values = metrics.merge(self._decode(retired['values']), self._decode(snapshot['values']), gauges=False)
+            # Readers skip the pids listed here, so the worker is never counted twice
+            self._write(retired_path, {'pids': retired['pids'] + [pid], 'values': self._encode(values)})
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def cleanup(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    @staticmethod
+    def _encode(values):
+        return {name: [[list(key), value] for key, value in series.items()] for name, series in values.items()}
+
+    @staticmethod
+    def _decode(encoded):
+        return {name: {tuple(tuple(pair) for pair in key): value for key, value in series}
+                for name, series in encoded.items()}
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, data):
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp, path)
+        except OSError as e:
+            sys.stderr.write(f"Could not write metrics snapshot {path}: {e}\n")
+
+
+shared_metrics = SharedMetrics()
+
+
+def metrics_route(path):
+    """Bounded route label for a request path"""
+    path = unquote(urlparse(path).path)
+    if path == '/metrics':
+        return 'metrics'
+    if path.endswith('/info/refs'):
+        return 'info_refs'
+    if path.endswith('/git-upload-pack'):
+        return 'upload_pack'
+    if path.endswith('/git-receive-pack'):
+        return 'receive_pack'
+    if path.endswith('.git/clone.bundle'):
+        return 'clone_bundle'
+    dumb_match = re.fullmatch(r'/([^/]+\.git)/(.+)', path)
+    if dumb_match and any(pattern.fullmatch(dumb_match.group(2)) for pattern, _, _ in DUMB_HTTP_FILES):
+        return 'dumb_http'
+    path_parts = [p for p in path.split('/') if p]
+    if not path_parts:
+        return 'repo_list'
+    if len(path_parts) == 1:
+        return 'repo'
+    if path_parts[0] == 'static':
+        return 'static'
+    if path_parts[1] in ('tree', 'blob', 'raw'):
+        return path_parts[1]
+    return 'other'
+
+
+def git_command_name(cmd):
+    """Metrics label for a command line: the git subcommand, or the program name"""
+    args = list(cmd)
+    if args and os.path.basename(args[0]) == 'nice':
+        args = args[3:]
+    if not args:
+        return 'unknown'
+    name = os.path.basename(args[0])
+    if name != 'git':
+        return name
+    i = 1
+    while i < len(args) and args[i].startswith('-'):
+        i += 2 if args[i] in ('-c', '-C', '--git-dir') else 1
+    return args[i] if i < len(args) else name
+
+
+class TraceSpan:
+    __slots__ = ('name', 'seconds', 'calls', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.children = {}
+
+
+class RequestTrace:
+    """Timing spans of one request, merged per call path.
+
+    Repeated calls of a helper under the same parent (a cat-file lookup per
+    tree entry, say) add up in one span with a call count.
+    """
+
+    def __init__(self):
+        self.root = TraceSpan('request')
+        self._stack = [self.root]
+
+    def enter(self, name):
+        parent = self._stack[-1]
+        span = parent.children.get(name)
+        if span is None:
+            span = parent.children[name] = TraceSpan(name)
+        self._stack.append(span)
+        return time.perf_counter()
+
+    def exit(self, started, count=True):
+        span = self._stack.pop()
+        span.seconds += time.perf_counter() - started
+        if count:
+            span.calls += 1
+
+    def format(self):
+        lines = []
+
+        def walk(span, depth):
+            for child in span.children.values():
+                lines.append(f"    {child.seconds:9.4f}s {child.calls:6d}x  {'  ' * depth}{child.name}\n")
+                walk(child, depth + 1)
+
+        walk(self.root, 0)
+        return ''.join(lines)
+
+
+_trace_local = threading.local()
+
+
+def current_trace():
+    """The RequestTrace of the request this thread is serving, if it is traced"""
+    return getattr(_trace_local, 'trace', None)
+
+
+def traced(func):
+    """Record calls to func as spans of the current request's trace.
+
+    For generator functions only the time spent inside the generator counts,
+    not the time its consumer spends between items.
+    """
+    # Handler methods are named bare; anything else keeps its class
+    name = func.__name__ if func.__qualname__.startswith('GitHTTPRequestHandler.') else func.__qualname__
+    
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            trace = current_trace()
+            if trace is None:
+                return (yield from func(*args, **kwargs))
+            generator = func(*args, **kwargs)
+            first = True
+            try:
+                while True:
+                    started = trace.enter(name)
+                    try:
+                        item = next(generator)
+                    except StopIteration as stop:
+                        return stop.value
+                    finally:
+                        trace.exit(started, count=first)
+                        first = False
+                    yield item
+            finally:
+                generator.close()
+        return generator_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return func(*args, **kwargs)
+        started = trace.enter(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace.exit(started)
+    return wrapper
+
+
+_slow_log_lock = threading.Lock()
+
+
+def write_slow_log(text):
+    if SLOW_LOG is None:
+        sys.stderr.write(text)
+        return
+    with _slow_log_lock, open(SLOW_LOG, 'a') as f:
+        f.write(text)
+
+
+def save_profile(profiler, route, elapsed):
+    """Dump a sampled request's profile, keeping the newest PROFILE_KEEP dumps"""
+    directory = PROFILE_DIR or server_cache_dir('profiles')
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}-{route}-{elapsed * 1000:.0f}ms.prof"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, name))
+        dumps = sorted(f for f in os.listdir(directory) if f.endswith('.prof'))
+    except OSError as e:
+        sys.stderr.write(f"Could not save profile {name}: {e}\n")
+        return
+    for old in dumps[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass    # another worker rotated it first
+
+
+class GitProcess(subprocess.Popen):
+    """subprocess.Popen that counts the spawn and times the process for /metrics"""
+
+    def __init__(self, args, **kwargs):
+        self.command_name = git_command_name(args)
+        self.started = time.monotonic()
+        self._reported = False
+        super().__init__(args, **kwargs)
+        metrics.inc('git_processes_started_total', command=self.command_name)
+
+    def poll(self):
+        returncode = super().poll()
+        if returncode is not None:
+            self._report()
+        return returncode
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        self._report()
+        return returncode
+
+    def _report(self):
+        if not self._reported:
+            self._reported = True
+            metrics.observe('git_process_duration_seconds', time.monotonic() - self.started,
+                            command=self.command_name)
+
+
+def run_git(cmd, timeout=None, capture_output=False, **kwargs):
+    """subprocess.run() on a GitProcess"""
+    if capture_output:
+        kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+    trace = current_trace()
+    started = trace.enter('git ' + git_command_name(cmd)) if trace is not None else None
+    try:
+        with GitProcess(cmd, **kwargs) as process:
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise
+    finally:
+        if trace is not None:
+            trace.exit(started)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+class RepoConcurrencyLimiter:
+    """Caps concurrent git-upload-pack/git-receive-pack runs per repository"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def acquire(self, repo_name, timeout):
+        """Wait for a slot on repo_name; returns False if none frees up in time"""
+        if self.limit <= 0:
+            return True
+        with self._lock:
+            semaphore = self._semaphores.get(repo_name)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limit)
+                self._semaphores[repo_name] = semaphore
+        return semaphore.acquire(timeout=timeout)
+
+    def release(self, repo_name):
+        if self.limit <= 0:
+            return
+        with self._lock:
+            semaphore = self._semaphores[repo_name]
+        semaphore.release()
+
+
+class RequestBodyError(Exception):
+    """A request body we cannot decode or that exceeds MAX_REQUEST_BODY"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class GzipBodyInflater:
+    """Incremental gzip decoder for request bodies, STREAM_CHUNK_SIZE bytes at a time"""
+
+    def __init__(self):
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data):
+        """Yield the decoded pieces of the next slice of the body"""
+        while data:
+            try:
+                chunk = self._inflater.decompress(data, STREAM_CHUNK_SIZE)
+            except zlib.error:
+                raise RequestBodyError(400, "Invalid gzip request body")
+            data = self._inflater.unconsumed_tail
+            if chunk:
+                yield chunk
+
+    def finish(self):
+        """Whatever is left once the body has ended"""
+        try:
+            tail = self._inflater.flush()
+        except zlib.error:
+            raise RequestBodyError(400, "Invalid gzip request body")
+        if not self._inflater.eof:
+            raise RequestBodyError(400, "Truncated gzip request body")
+        return tail
+
+
+class AdmissionBudget:
+    """Concurrency budget with a bounded wait queue and a wait deadline.
+
+    Up to limit requests run at once; up to max_waiting more wait at most
+    max_wait seconds for a slot. Anything beyond that is shed, and the
+    caller answers 503 with retry_after as the hint.
+    """
+
+    def __init__(self, limit, max_waiting, max_wait, retry_after):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, wait=True, reserved=False):
+        """Take a slot; returns False if the request should be shed (or, with wait=False, must wait).
+
+        reserved means reserve_wait() has already counted the caller as waiting.
+        """
+        if self.limit <= 0:
+            return True
+        with self._cond:
+            if not reserved:
+                if self.active < self.limit and not self.waiting:
+                    self.active += 1
+                    return True
+                if not wait:
+                    return False
+                if self.waiting >= self.max_waiting:
+                    self.shed += 1
+                    return False
+                self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.max_wait
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def reserve_wait(self):
+        """Count the caller as waiting before acquire(reserved=True) runs on another thread; False if shed"""
+        with self._cond:
+            if self.waiting >= self.max_waiting:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            return True
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class AdmissionControl:
+    """Separate admission budgets for pack generation/pushes, pack downloads and everything else.
+
+    Clones and pushes cost a CPU core (and memory) each, so they queue
+    against their own small budget. Long pack file and clone bundle
+    downloads get a budget of their own too, so browser pages, files and
+    ref advertisements are never stuck behind a clone storm.
+    """
+
+    def __init__(self, pack_limit=PACK_CONCURRENCY, pack_queue=PACK_QUEUE_DEPTH, pack_wait=PACK_QUEUE_TIMEOUT):
+        self.pack = AdmissionBudget(pack_limit, pack_queue, pack_wait, retry_after=10)
+        self.transfer = AdmissionBudget(TRANSFER_CONCURRENCY, TRANSFER_QUEUE_DEPTH, TRANSFER_QUEUE_TIMEOUT,
+                                        retry_after=10)
+        self.browse = AdmissionBudget(BROWSE_CONCURRENCY, BROWSE_QUEUE_DEPTH, BROWSE_QUEUE_TIMEOUT, retry_after=2)
+
+    def budgets(self):
+        """(name, budget) for every budget"""
+        return (('pack', self.pack), ('transfer', self.transfer), ('browse', self.browse))
+
+    def budget_for(self, method, path, shared=False):
+        """The budget a request is charged to, or None if it is charged later.
+
+        Coalesced upload-packs (shared=True) are charged once per backend run,
+        by the run itself, not once per request replaying its output.
+        """
+        if method == 'POST' and path.endswith(('/git-upload-pack', '/git-receive-pack')):
+            return None if shared else self.pack
+        if method == 'GET' and metrics_route(path) in ('dumb_http', 'clone_bundle'):
+            return self.transfer
+        return self.browse
+
+
+class CatFileError(Exception):
+    """A `git cat-file` worker died or answered out of protocol"""
+
+
+class CatFileProcess:
+    """A long-lived `git cat-file --batch` or `--batch-check` process"""
+
+    def __init__(self, repo_path, mode):
+        self.repo_path = repo_path
+        self.mode = mode
+        self.last_used = time.monotonic()
+        self.process = GitProcess(
+            ['git', '--git-dir', repo_path, 'cat-file', f'--{mode}'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def query(self, spec):
+        """Look up spec; returns (sha, type, size, data) or None if it does not exist.
+
+        data is None in --batch-check mode.
+        """
+        self.last_used = time.monotonic()
+        try:
+            self.process.stdin.write(spec.encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+        except (OSError, ValueError) as e:
+            raise CatFileError(str(e))
+        if not header.endswith(b'\n'):
+            raise CatFileError('cat-file exited')
+        # "<spec> missing" echoes the spec back, and it may contain spaces
+        if header.endswith((b' missing\n', b' ambiguous\n')):
+            return None
+        parts = header.decode('utf-8', errors='replace').split()
+        if len(parts) != 3 or not parts[2].isdigit():
+            raise CatFileError(f'unexpected cat-file header: {header!r}')
+        sha, obj_type, size = parts[0], parts[1], int(parts[2])
+        data = None
+        if self.mode == 'batch':
+            data = self.process.stdout.read(size + 1)
+            if len(data) != size + 1:
+                raise CatFileError('short read from cat-file')
+            data = data[:-1]
+        return sha, obj_type, size, data
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class CatFilePool:
+    """Per-repository pools of long-lived `git cat-file` workers.
+
+    Each (repository, mode) pair gets at most `size` live workers. Workers that
+    sit unused for `idle_timeout` seconds are stopped by a reaper thread, and a
+    worker that dies mid-query is replaced and the query retried once.
+    """
+
+    def __init__(self, size=CATFILE_POOL_SIZE, idle_timeout=CATFILE_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}     # (repo_path, mode) -> [CatFileProcess]
+        self._slots = {}    # (repo_path, mode) -> BoundedSemaphore
+        self._reaper = None
+
+    @traced
+    def query(self, repo_path, mode, spec):
+        if '\n' in spec:
+            return None
+        key = (repo_path, mode)
+        with self._lock:
+            slots = self._slots.get(key)
+            if slots is None:
+                slots = self._slots[key] = threading.BoundedSemaphore(self.size)
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_idle, name='cat-file-reaper', daemon=True)
+                self._reaper.start()
+        with slots:
+            worker = self._checkout(key)
+            try:
+                result = worker.query(spec)
+            except CatFileError:
+                worker.close()
+                worker = CatFileProcess(repo_path, mode)
+                try:
+                    result = worker.query(spec)
+                except BaseException:
+                    worker.close()
+                    raise
+            except BaseException:
+                # Its output stream is in an unknown state, so it cannot go back in the pool
+                worker.close()
+                raise
+            with self._lock:
+                self._idle.setdefault(key, []).append(worker)
+            return result
+
+    def _checkout(self, key):
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                worker = idle.pop() if idle else None
+            if worker is None:
+                return CatFileProcess(*key)
+            if worker.alive():
+                return worker
+            worker.close()
+
+    def _reap_idle(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            cutoff = time.monotonic() - self.idle_timeout
+            expired = []
+            with self._lock:
+                for key, idle in self._idle.items():
+                    expired.extend(w for w in idle if w.last_used < cutoff)
+                    idle[:] = [w for w in idle if w.last_used >= cutoff]
+            for worker in expired:
+                worker.close()
+
+    def close(self):
+        with self._lock:
+            workers = [w for idle in self._idle.values() for w in idle]
+            self._idle.clear()
+        for worker in workers:
+            worker.close()
+
+
+catfile_pool = CatFilePool()
+
+
+@traced
+def read_refs(repo_path, prefix):
+    """Return {refname: sha} for refs under prefix from loose refs and packed-refs"""
+    refs = {}
+    try:
+        with open(os.path.join(repo_path, 'packed-refs'), 'rb') as f:
+            for line in f:
+                if line.startswith((b'#', b'^')):
+                    continue
+                parts = line.decode('utf-8', errors='replace').split()
+                if len(parts) == 2 and parts[1].startswith(prefix):
+                    refs[parts[1]] = parts[0]
+    except OSError:
+        pass
+    ref_root = os.path.join(repo_path, *prefix.rstrip('/').split('/'))
+    for dirpath, dirnames, filenames in os.walk(ref_root):
+        for filename in filenames:
+            if filename.endswith('.lock'):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            refname = os.path.relpath(full_path, repo_path).replace(os.sep, '/')
+            try:
+                with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
+                    value = f.read().strip()
+            except OSError:
+                continue
+            if value and not value.startswith('ref:'):
+                refs[refname] = value
+    return refs
+
+
+@traced
+def ref_state_fingerprint(repo_path):
+    """Cheap token that changes whenever a ref in the repository is updated.
+
+    Git updates refs by renaming lock files into place, so every ref change
+    bumps the mtime of HEAD, packed-refs or a directory under refs/. The
+    config is included because it decides which refs are advertised.
+    """
+    state = []
+    for name in ('HEAD', 'packed-refs', 'config'):
+        try:
+            st = os.stat(os.path.join(repo_path, name))
+            state.append((name, st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            state.append((name, None))
+    for dirpath, dirnames, filenames in os.walk(os.path.join(repo_path, 'refs')):
+        try:
+            state.append((dirpath, os.stat(dirpath).st_mtime_ns))
+        except OSError:
+            pass
+    return tuple(state)
+
+
+class RefCache:
+    """Per-repository cache of ref-derived values (branch lists, default branch).
+
+    Entries are dropped as soon as the repository's ref state fingerprint
+    changes, or immediately when invalidate() is called after a push.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # repo_path -> (fingerprint, {key: value})
+
+    def get(self, repo_path, key, compute):
+        fingerprint = ref_state_fingerprint(repo_path)
+        with self._lock:
+            entry = self._entries.get(repo_path)
+            if entry is not None and entry[0] == fingerprint and key in entry[1]:
+                return entry[1][key]
+        value = compute()
+        with self._lock:
+            entry = self._entries.get(repo_path)
+            if entry is None or entry[0] != fingerprint:
+                entry = self._entries[repo_path] = (fingerprint, {})
+            entry[1][key] = value
+        return value
+
+    def invalidate(self, repo_path):
+        with self._lock:
+            self._entries.pop(repo_path, None)
+
+
+ref_cache = RefCache()
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 8
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, size)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store value; items bigger than an eighth of the budget are not cached"""
+        if size > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._data[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Tree listings and blobs keyed by object id; content-addressed, so never stale
+object_cache = LRUCache(OBJECT_CACHE_BYTES)
+
+# Rendered browser pages keyed by their ETag
+page_cache = LRUCache(PAGE_CACHE_BYTES)
+
+
+def server_cache_dir(*parts):
+    """Path under the on-disk cache directory"""
+    root = CACHE_DIR or os.path.join(GIT_REPO_DIR, '.git-server-cache')
+    return os.path.join(root, *parts)
+
+
+class LastCommitIndex:
+    """Per-branch map of path -> last commit touching it, persisted on disk.
+
+    The index is built once with a single `git log --name-only` walk and then
+    brought forward by scanning only tip..new-tip when the branch moves. A
+    rewritten branch (new tip not descended from the old one) is rebuilt.
+    Initial builds run in the background; callers fall back to a direct
+    `git log -1 -- path` until they finish. Only branches are indexed; other
+    revisions (shas, tags, main~3) always take the fallback, so arbitrary
+    URLs cannot start history walks or grow the index.
+    """
+
+    COMMIT_MARKER = '\x01'
+
+    def __init__(self, max_entries=LAST_COMMIT_INDEX_ENTRIES, max_builds=LAST_COMMIT_INDEX_BUILDS):
+        self.max_entries = max_entries
+        self.max_builds = max_builds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (repo_path, branch) -> {'tip', 'paths', 'commits'}, least recent first
+        self._key_locks = {}
+        self._building = set()
+
+    @traced
+    def get(self, repo_path, branch, tip):
+        """Index for branch at tip, or None if branch is not a branch or its initial build is running"""
+        heads = ref_cache.get(repo_path, 'heads', lambda: read_refs(repo_path, 'refs/heads/'))
+        if heads.get(f'refs/heads/{branch}') != tip:
+            return None
+        key = (repo_path, branch)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['tip'] == tip:
+                self._entries.move_to_end(key)
+                return entry
+            if key in self._building:
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load(repo_path, branch)
+            if entry is not None and entry['tip'] != tip:
+                entry = self._update(repo_path, branch, entry, tip)
+            if entry is not None:
+                self._remember(key, entry)
+                return entry
+        
+        self._start_build(repo_path, branch, tip)
+        return None
+
+    def _remember(self, key, entry):
+        """Keep entry in memory, dropping the least recently used beyond max_entries"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                key_lock = self._key_locks.get(evicted)
+                if key_lock is not None and not key_lock.locked():
+                    del self._key_locks[evicted]
+
+    def lookup(self, entry, path):
+        """Commit info dict for path from an index entry, or None"""
+        commit = entry['paths'].get(path)
+        if commit is None:
+            return None
+        author, email, date, message = entry['commits'][commit]
+        return {'hash': commit, 'author': author, 'email': email, 'date': date, 'message': message}
+
+    def refresh(self, repo_path):
+        """Bring every loaded branch of repo_path up to its current tip (after a push)"""
+        with self._lock:
+            branches = [b for (r, b) in self._entries if r == repo_path]
+        heads = read_refs(repo_path, 'refs/heads/')
+        for branch in branches:
+            tip = heads.get(f'refs/heads/{branch}')
+            if tip is not None:
+                self.get(repo_path, branch, tip)
+
+    def _path(self, repo_path, branch):
+        name = hashlib.sha1(branch.encode('utf-8')).hexdigest() + '.json'
+        return server_cache_dir('last-commit', os.path.basename(repo_path), name)
+
+    def _load(self, repo_path, branch):
+        try:
+            with open(self._path(repo_path, branch), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry if entry.get('branch') == branch else None
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, repo_path, branch, entry):
+        target = self._path(repo_path, branch)
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(tmp, target)
+        except OSError as e:
+            sys.stderr.write(f"Could not save last-commit index {target}: {e}\n")
+
+    def _start_build(self, repo_path, branch, tip):
+        key = (repo_path, branch)
+        with self._lock:
+            # Past the cap the build is simply not started; a later request tries again
+            if key in self._building or len(self._building) >= self.max_builds:
+                return
+            self._building.add(key)
+        
+        def build():
+            try:
+                paths, commits = self._scan(repo_path, tip)
+                entry = {'branch': branch, 'tip': tip, 'paths': paths, 'commits': commits}
+                self._save(repo_path, branch, entry)
+                self._remember(key, entry)
+            except Exception as e:
+                sys.stderr.write(f"Last-commit index build failed for {repo_path} {branch}: {e}\n")
+            finally:
+                with self._lock:
+                    self._building.discard(key)
+        
+        threading.Thread(target=build, name='last-commit-index', daemon=True).start()
+
+    def _update(self, repo_path, branch, entry, tip):
+        """Apply commits in entry tip..tip; None if the branch was rewritten"""
+        result = run_git(
+            ['git', '--git-dir', repo_path, 'merge-base', '--is-ancestor', entry['tip'], tip],
+            capture_output=True
+        )
+        if result.returncode != 0:
+            return None
+        paths, commits = self._scan(repo_path, f"{entry['tip']}..{tip}")
+        merged_paths = dict(entry['paths'])
+        merged_paths.update(paths)
+        merged_commits = dict(entry['commits'])
+        merged_commits.update(commits)
+        live = set(merged_paths.values())
+        merged_commits = {c: info for c, info in merged_commits.items() if c in live}
+        updated = {'branch': branch, 'tip': tip, 'paths': merged_paths, 'commits': merged_commits}
+        self._save(repo_path, branch, updated)
+        return updated
+
+    def _scan(self, repo_path, rev_range):
+        """Walk rev_range newest first, recording the first commit seen for each path and its directories"""
+        process = GitProcess(
+            ['git', '-c', 'core.quotePath=false', '--git-dir', repo_path, 'log', '--name-only', '--no-renames',
+             f'--format={self.COMMIT_MARKER}%H%x00%an%x00%ae%x00%ad%x00%s', '--date=iso', rev_range, '--'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        paths = {}
+        commits = {}
+        current = None
+        for raw_line in process.stdout:
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\n')
+            if line.startswith(self.COMMIT_MARKER):
+                fields = line[1:].split('\0')
+                if len(fields) < 5:
+                    current = None
+                    continue
+                current = fields[0]
+                commits[current] = fields[1:5]
+                continue
+            if not line or current is None:
+                continue
+            path = line
+            while path and path not in paths:
+                paths[path] = current
+                path = os.path.dirname(path)
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f'git log {rev_range} failed')
+        live = set(paths.values())
+        return paths, {c: info for c, info in commits.items() if c in live}
+
+
+last_commit_index = LastCommitIndex()
+
+
+class FanoutBuffer:
+    """Append-only byte stream written once and read by any number of clients.
+
+    The first memory_limit bytes stay in memory; past that the stream spills to
+    an unlinked temporary file, so the writer never waits for a slow reader and
+    memory stays bounded however far behind a reader falls.
+    """
+
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self._cond = threading.Condition()
+        self._memory = bytearray()
+        self._file = None
+        self._size = 0
+        self._done = False
+
+    def append(self, data):
+        with self._cond:
+            if self._file is None and self._size + len(data) > self.memory_limit:
+                self._file = tempfile.TemporaryFile(prefix='git-server-fanout-')
+                self._file.write(self._memory)
+                self._memory = None
+            if self._file is not None:
+                self._file.write(data)
+                self._file.flush()
+            else:
+                self._memory.extend(data)
+            self._size += len(data)
+            self._cond.notify_all()
+
+    def finish(self):
+        """Mark the stream complete; readers at the end now get b''"""
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def read(self, offset, size):
+        """Up to size bytes from offset; blocks until some exist, b'' at the end"""
+        with self._cond:
+            while offset >= self._size and not self._done:
+                self._cond.wait()
+            if offset >= self._size:
+                return b''
+            size = min(size, self._size - offset)
+            if self._file is not None:
+                return os.pread(self._file.fileno(), size, offset)
+            return bytes(self._memory[offset:offset + size])
+
+    def close(self):
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._memory = None
+
+
+class FanoutReader:
+    """Sequential file-like view (readline/read1) of a FanoutBuffer"""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._offset = 0
+        self._pending = b''
+
+    def read1(self, size):
+        if self._pending:
+            data, self._pending = self._pending[:size], self._pending[size:]
+            return data
+        data = self._buffer.read(self._offset, size)
+        self._offset += len(data)
+        return data
+
+    def readline(self):
+        while b'\n' not in self._pending:
+            data = self._buffer.read(self._offset, STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            self._offset += len(data)
+            self._pending += data
+        line, newline, self._pending = self._pending.partition(b'\n')
+        return line + newline
+
+
+class UploadPackFlight:
+    """One git-http-backend run whose output is shared by identical requests"""
+
+    def __init__(self):
+        self.output = FanoutBuffer(FANOUT_MEMORY_BYTES)
+        self.stderr = b''
+        self.busy = False       # no repository slot freed up, so nothing ran
+        self.readers = 0
+        self.finished = False
+
+
+class UploadPackCoalescer:
+    """Runs identical concurrent upload-pack requests once (single-flight).
+
+    The first request for a key starts the backend in a background thread; it
+    and every identical request that arrives while that run is in flight replay
+    the shared output from the start. Finished runs are forgotten, so a request
+    arriving afterwards gets a fresh run against the current refs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, key, run):
+        """Return the in-flight run for key, starting run(flight) if there is none"""
+        worker = None
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = UploadPackFlight()
+                worker = threading.Thread(target=self._run, args=(key, flight, run), daemon=True)
+                self.started += 1
+            else:
+                self.joined += 1
+            flight.readers += 1
+        if worker is not None:
+            worker.start()
+        return flight
+
+    def leave(self, flight):
+        with self._lock:
+            flight.readers -= 1
+            release = flight.finished and flight.readers == 0
+        if release:
+            flight.output.close()
+
+    def _run(self, key, flight, run):
+        try:
+            run(flight)
+        except Exception as e:
+            flight.stderr = str(e).encode('utf-8')
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.finished = True
+                release = flight.readers == 0
+            flight.output.finish()
+            if release:
+                flight.output.close()
+
+
+upload_pack_flights = UploadPackCoalescer()
+
+
+def run_shared_backend(flight, cmd, env, body):
+    """Run git-http-backend on a buffered request body, appending stdout to flight.output"""
+    process = GitProcess(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        cwd=GIT_REPO_DIR
+    )
+    stderr_tail = bytearray()
+
+    def drain_stderr():
+        for chunk in iter(lambda: process.stderr.read1(STREAM_CHUNK_SIZE), b''):
+            stderr_tail.extend(chunk)
+            del stderr_tail[:-STDERR_TAIL_SIZE]
+
+    def feed_stdin():
+        try:
+            process.stdin.write(body)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    helpers = [threading.Thread(target=drain_stderr, daemon=True),
+               threading.Thread(target=feed_stdin, daemon=True)]
+    for helper in helpers:
+        helper.start()
+    try:
+        for chunk in iter(lambda: process.stdout.read1(STREAM_CHUNK_SIZE), b''):
+            flight.output.append(chunk)
+    finally:
+        process.stdout.close()
+        process.wait()
+        for helper in helpers:
+            helper.join()
+        process.stderr.close()
+        flight.stderr = bytes(stderr_tail)
+
+
+class CloneBundles:
+    """Keeps a `git bundle --all` of each repository for bundle-uri clones.
+
+    Bundles live under <cache>/bundles/ and are rebuilt in the background
+    once a repository has had no push for BUNDLE_DEBOUNCE seconds (or
+    BUNDLE_MAX_DELAY after the first), so a burst of pushes costs one
+    rebuild; builds run one at a time. Refs that moved while a build ran
+    get another build. A slightly stale bundle is still useful: clients
+    fetch whatever it lacks from the server afterwards.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_slot = threading.Lock()
+        self._timers = {}       # repo_name -> (pending rebuild, time of the first push it covers, token)
+        self._building = set()
+        self._dirty = set()     # pushed to while its bundle was being built
+
+    def path(self, repo_name):
+        return server_cache_dir('bundles', repo_name + '.bundle')
+
+    def available(self, repo_name):
+        return os.path.isfile(self.path(repo_name))
+
+    def start(self):
+        """Build bundles for repositories that do not have one yet"""
+        for repo_name in sorted(os.listdir(GIT_REPO_DIR)):
+            if (repo_name.endswith('.git') and os.path.isdir(os.path.join(GIT_REPO_DIR, repo_name))
+                    and not self.available(repo_name)):
+                self.schedule(repo_name, delay=0)
+
+    def schedule(self, repo_name, delay=None):
+        """Rebuild repo_name's bundle delay seconds (BUNDLE_DEBOUNCE by default) after the latest call"""
+        with self._lock:
+            if repo_name in self._building:
+                self._dirty.add(repo_name)
+                return
+            now = time.monotonic()
+            pending = self._timers.get(repo_name)
+            first = now
+            if pending is not None:
+                pending[0].cancel()
+                first = pending[1]
+            delay = BUNDLE_DEBOUNCE if delay is None else delay
+            token = object()
+            timer = threading.Timer(max(min(delay, first + BUNDLE_MAX_DELAY - now), 0), self._build,
+                                    args=(repo_name, token))
+            timer.daemon = True
+            self._timers[repo_name] = (timer, first, token)
+        timer.start()
+
+    def _build(self, repo_name, token):
+        with self._lock:
+            pending = self._timers.get(repo_name)
+            if pending is None or pending[2] is not token:
+                return  # re-armed by a later push after this timer had already fired
+            del self._timers[repo_name]
+            self._building.add(repo_name)
+        repo_path = os.path.join(GIT_REPO_DIR, repo_name)
+        fingerprint = ref_state_fingerprint(repo_path)
+        try:
+            with self._build_slot:
+                self._write(repo_name)
+        except Exception as e:
+            sys.stderr.write(f"Bundle build failed for {repo_name}: {e}\n")
+        finally:
+            with self._lock:
+                self._building.discard(repo_name)
+                # Also catches pushes that went to another server process
+                again = repo_name in self._dirty or ref_state_fingerprint(repo_path) != fingerprint
+                self._dirty.discard(repo_name)
+            if again:
+                self.schedule(repo_name)
+
+    def _write(self, repo_name):
+        repo_path = os.path.join(GIT_REPO_DIR, repo_name)
+        target = self.path(repo_name)
+        if not read_refs(repo_path, 'refs/'):
+            return  # nothing to bundle yet
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target + '.lock', 'w') as lock_file:
+            try:
+                # Another server process sharing the cache may be building it
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            tmp = f'{target}.{os.getpid()}.tmp'
+            result = run_git(
+                ['git', '--git-dir', repo_path, 'bundle', 'create', '-q', tmp, '--all'],
+                stdin=subprocess.DEVNULL, capture_output=True
+            )
+            if result.returncode != 0:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise RuntimeError(result.stderr.decode('utf-8', errors='ignore').strip())
+            os.replace(tmp, target)
+
+
+clone_bundles = CloneBundles()
+
+
+class RepoMaintenance:
+    """Repacks and indexes repositories in the background while they are idle.
+
+    Pushes mark a repository as due, and so does a missing commit-graph or
+    multi-pack-index at startup. A due repository is maintained once it has
+    had no git traffic for MAINTENANCE_IDLE seconds and no pack request is
+    running on the server. Runs go one repository at a time, niced and with
+    a single pack thread. With --workers only one process runs the
+    scheduler; the others' pushes and traffic reach it through follow().
+    Each run does a geometric repack of new objects, rewrites the
+    multi-pack-index with reachability bitmaps, and extends a split
+    commit-graph.
+    """
+
+    STEPS = (
+        ['repack', '-d', '-l', '--geometric=2', '--write-midx', '--write-bitmap-index', '-q'],
+        ['commit-graph', 'write', '--reachable', '--split', '--changed-paths', '--no-progress'],
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pushes = {}           # repo_name -> pushes since its last maintenance
+        self._push_totals = {}      # repo_name -> pushes this process has received, for the scheduling worker
+        self._last_activity = {}    # repo_name -> monotonic time of its last git request
+        self._seen = {}             # pid -> {repo_name: push total} already taken from that worker
+        self._busy = None
+        self._follow = None
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+
+    def start(self, busy=None, follow=None):
+        """Start the scheduler; busy() returning True postpones maintenance.
+
+        follow() returns {pid: shared_state()} of other worker processes.
+        """
+        self._busy = busy
+        self._follow = follow
+        for repo_name in sorted(os.listdir(GIT_REPO_DIR)):
+            repo_path = os.path.join(GIT_REPO_DIR, repo_name)
+            if not (repo_name.endswith('.git') and os.path.isdir(repo_path)):
+                continue
+            indexed = (os.path.exists(os.path.join(repo_path, 'objects', 'pack', 'multi-pack-index'))
+                       and os.path.exists(os.path.join(repo_path, 'objects', 'info', 'commit-graphs')))
+            if not indexed:
+                with self._lock:
+                    self._pushes.setdefault(repo_name, 1)
+        self._thread = threading.Thread(target=self._schedule, name='repo-maintenance', daemon=True)
+        self._thread.start()
+
+    def record_push(self, repo_name):
+        with self._lock:
+            self._pushes[repo_name] = self._pushes.get(repo_name, 0) + 1
+            self._push_totals[repo_name] = self._push_totals.get(repo_name, 0) + 1
+            self._last_activity[repo_name] = time.monotonic()
+
+    def touch(self, repo_name):
+        """Note git traffic on repo_name, holding its maintenance off a while longer"""
+        with self._lock:
+            self._last_activity[repo_name] = time.monotonic()
+
+    def shared_state(self):
+        """Push totals and last traffic of this process, as published to the scheduling worker"""
+        with self._lock:
+            return {'pushes': dict(self._push_totals), 'activity': dict(self._last_activity)}
+
+    def follow(self, states):
+        """Take in pushes and traffic other worker processes reported since the last call"""
+        with self._lock:
+            for pid, state in states.items():
+                seen = self._seen.setdefault(pid, {})
+                for repo_name, total in state.get('pushes', {}).items():
+                    new = total - seen.get(repo_name, 0)
+                    if new > 0:
+                        self._pushes[repo_name] = self._pushes.get(repo_name, 0) + new
+                        seen[repo_name] = total
+                for repo_name, last in state.get('activity', {}).items():
+                    # CLOCK_MONOTONIC is system-wide, so the times compare across processes
+                    if last > self._last_activity.get(repo_name, 0):
+                        self._last_activity[repo_name] = last
+            for pid in set(self._seen) - set(states):
+                del self._seen[pid]
+
+    def _schedule(self):
+        while True:
+            time.sleep(MAINTENANCE_INTERVAL)
+            if self._follow is not None:
+                self.follow(self._follow())
+            now = time.monotonic()
+            with self._lock:
+                due = [repo_name for repo_name, pushes in self._pushes.items()
+                       if pushes and now - self._last_activity.get(repo_name, 0) >= MAINTENANCE_IDLE]
+            for repo_name in due:
+                if self._busy is not None and self._busy():
+                    break
+                try:
+                    self._maintain(repo_name)
+                except Exception as e:
+                    self.failures += 1
+                    sys.stderr.write(f"Maintenance failed for {repo_name}: {e}\n")
+
+    def _maintain(self, repo_name):
+        repo_path = os.path.join(GIT_REPO_DIR, repo_name)
+        with self._lock:
+            pushes = self._pushes.get(repo_name, 0)
+        if not os.path.isdir(repo_path):
+            with self._lock:
+                self._pushes.pop(repo_name, None)
+            return
+        lock_path = server_cache_dir('maintenance', repo_name + '.lock')
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            try:
+                # Another server process sharing the repositories may be at it
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # That run covers the same pushes, so do not repeat it once the lock is free
+                self._done(repo_name, pushes)
+                return
+            for step in self.STEPS:
+                result = run_git(
+                    ['nice', '-n', str(MAINTENANCE_NICE),
+                     'git', '-c', f'pack.threads={MAINTENANCE_PACK_THREADS}', '--git-dir', repo_path, *step],
+                    stdin=subprocess.DEVNULL, capture_output=True
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(f"git {step[0]}: {result.stderr.decode('utf-8', errors='ignore').strip()}")
+        self.runs += 1
+        self._done(repo_name, pushes)
+
+    def _done(self, repo_name, pushes):
+        """Clear the pushes a maintenance run has covered"""
+        with self._lock:
+            # Pushes that landed during the run keep the repository due
+            remaining = self._pushes.get(repo_name, 0) - pushes
+            if remaining > 0:
+                self._pushes[repo_name] = remaining
+            else:
+                self._pushes.pop(repo_name, None)
+
+
+repo_maintenance = RepoMaintenance()
+
+
+def after_receive_pack(repo_name, repo_path):
+    """Push finished: drop ref-derived data without waiting for a stat"""
+    ref_cache.invalidate(repo_path)
+    if BUNDLE_URIS:
+        clone_bundles.schedule(repo_name)
+    repo_maintenance.record_push(repo_name)
+    threading.Thread(target=last_commit_index.refresh, args=(repo_path,), daemon=True).start()
+
+
+def git_repo_name(path):
+    """Repository part of a smart-HTTP path such as /repo.git/info/refs, or None"""
+    for marker in ('/info/refs', '/git-upload-pack', '/git-receive-pack'):
+        if marker in path:
+            return path.split(marker)[0].lstrip('/') or None
+    if path.endswith('.git'):
+        return path.lstrip('/')
+    return None
+
+
+def add_git_config_env(env, settings):
+    """Pass config settings to git subprocesses via GIT_CONFIG_COUNT/KEY_n/VALUE_n"""
+    count = int(env.get('GIT_CONFIG_COUNT', '0') or 0)
+    for key, value in settings:
+        env[f'GIT_CONFIG_KEY_{count}'] = key
+        env[f'GIT_CONFIG_VALUE_{count}'] = value
+        count += 1
+    env['GIT_CONFIG_COUNT'] = str(count)
+
+
+def parse_cgi_headers(lines):
+    """Parse CGI response header lines into (status, [(lowercase name, value)])"""
+    status_code = 200
+    headers = []
+    for line in lines:
+        line = line.strip()
+        if not line or ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if key == 'status':
+            try:
+                status_code = int(value.split()[0])
+            except:
+                pass
+        else:
+            headers.append((key, value))
+    return status_code, headers
+
+
+def parse_tree(data):
+    """Parse a raw tree object into (mode, sha, name) tuples"""
+    entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        mode = data[pos:space].decode('ascii')
+        name = data[space + 1:nul].decode('utf-8', errors='replace')
+        sha = data[nul + 1:nul + 21].hex()
+        entries.append((mode, sha, name))
+        pos = nul + 21
+    return entries
+
+
+def make_compressor(encoding):
+    """Streaming compressor with compress()/flush() for a content-coding, or None"""
+    if encoding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return None
+
+
+def compress_bytes(data, encoding):
+    compressor = make_compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def negotiate_encoding(accept_encoding, offered=None):
+    """Pick zstd or gzip (or only those in offered) from an Accept-Encoding header; None means identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        token, _, params = item.strip().partition(';')
+        token = token.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+    wildcard = weights.get('*', 0.0)
+    candidates = ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+    if offered is not None:
+        candidates = [encoding for encoding in candidates if encoding in offered]
+    best = None
+    for encoding in candidates:
+        q = weights.get(encoding, wildcard)
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def encoded_etag(etag, encoding):
+    """Strong ETags must differ between content-codings of the same page"""
+    if encoding is None:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+# Page templates
+STYLESHEET = """body {
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Helvetica, Arial, sans-serif;
+    margin: 0;
+    padding: 20px;
+    background: #f6f8fa;
+    color: #24292e;
+}
+.container {
+    max-width: 1200px;
+    margin: 0 auto;
+    background: white;
+    border-radius: 6px;
+    box-shadow: 0 1px 3px rgba(0,0,0,0.12);
+    padding: 20px;
+}
+h1 {
+    margin: 0 0 20px 0;
+    font-size: 24px;
+    border-bottom: 1px solid #eaecef;
+    padding-bottom: 10px;
+}
+.header {
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+    margin-bottom: 20px;
+    flex-wrap: wrap;
+}
+.breadcrumb {
+    margin-bottom: 15px;
+}
+.breadcrumb a {
+    color: #0366d6;
+    text-decoration: none;
+}
+.breadcrumb a:hover {
+    text-decoration: underline;
+}
+.breadcrumb span {
+    margin: 0 5px;
+    color: #586069;
+}
+.branch-selector {
+    margin-bottom: 15px;
+}
+.branch-selector select {
+    padding: 5px 10px;
+    border: 1px solid #d1d5da;
+    border-radius: 3px;
+    font-size: 14px;
+}
+.file-list {
+    border: 1px solid #e1e4e8;
+    border-radius: 3px;
+}
+.file-item {
+    display: flex;
+    align-items: center;
+    padding: 8px 16px;
+    border-bottom: 1px solid #eaecef;
+}
+.file-item:last-child {
+    border-bottom: none;
+}
+.file-item:hover {
+    background: #f6f8fa;
+}
+.file-icon {
+    margin-right: 8px;
+    width: 16px;
+    text-align: center;
+}
+.file-name {
+    flex: 1;
+}
+.file-name a {
+    color: #0366d6;
+    text-decoration: none;
+}
+.file-name a:hover {
+    text-decoration: underline;
+}
+.file-commit {
+    flex: 2;
+    color: #586069;
+    font-size: 12px;
+    overflow: hidden;
+    text-overflow: ellipsis;
+    white-space: nowrap;
+    padding: 0 10px;
+}
+.file-date {
+    color: #586069;
+    font-size: 12px;
+    white-space: nowrap;
+}
+.file-info {
+    background: #f6f8fa;
+    border: 1px solid #e1e4e8;
+    border-radius: 3px;
+    padding: 10px;
+    margin-bottom: 15px;
+    font-size: 12px;
+    color: #586069;
+}
+.file-content {
+    background: #ffffff;
+    border: 1px solid #e1e4e8;
+    border-radius: 3px;
+    overflow: hidden;
+}
+.file-content pre {
+    margin: 0;
+    padding: 16px;
+    font-family: 'SFMono-Regular', Consolas, 'Liberation Mono', Menlo, monospace;
+    font-size: 12px;
+    line-height: 1.45;
+    overflow-x: auto;
+    background: #ffffff;
+}
+.file-content code {
+    white-space: pre;
+}
+.binary-warning {
+    padding: 20px;
+    text-align: center;
+    color: #586069;
+}
+.actions {
+    margin-top: 20px;
+    padding-top: 20px;
+    border-top: 1px solid #eaecef;
+}
+.actions a {
+    color: #0366d6;
+    text-decoration: none;
+    margin-right: 15px;
+}
+.actions a:hover {
+    text-decoration: underline;
+}
+body.repo-list {
+    padding: 40px 20px;
+}
+.repo-list .container {
+    max-width: 800px;
+    padding: 30px;
+}
+.repo-list h1 {
+    margin: 0 0 30px 0;
+    font-size: 32px;
+    padding-bottom: 15px;
+}
+.repo-list ul {
+    list-style: none;
+    padding: 0;
+    margin: 0;
+}
+.repo-list li {
+    padding: 12px 0;
+    border-bottom: 1px solid #eaecef;
+}
+.repo-list li:last-child {
+    border-bottom: none;
+}
+.repo-list a {
+    color: #0366d6;
+    text-decoration: none;
+    font-size: 16px;
+}
+.repo-list a:hover {
+    text-decoration: underline;
+}
+.repo-actions {
+    margin-left: 15px;
+    font-size: 12px;
+    color: #586069;
+}
+.repo-list .repo-actions a {
+    font-size: 12px;
+    margin-left: 10px;
+}
+"""
+STYLESHEET_BYTES = STYLESHEET.encode('utf-8')
+# Versioned by content, so browsers may cache it forever
+STYLESHEET_NAME = f"git-server-{hashlib.sha1(STYLESHEET_BYTES).hexdigest()[:12]}.css"
+STYLESHEET_URL = f"/static/{STYLESHEET_NAME}"
+STYLESHEET_GZIP = compress_bytes(STYLESHEET_BYTES, 'gzip')
+
+
+class Template:
+    """Page template compiled once into literal text and {{name}} slots.
+
+    Slot values are strings or iterables of strings (for example a generator
+    over directory entries); render() yields the pieces in order, so a page
+    is never assembled into one string. Keyword arguments given to the
+    constructor are baked into the literal text at compile time.
+    """
+
+    SLOT = re.compile(r'\{\{(\w+)\}\}')
+
+    def __init__(self, source, **constants):
+        self.parts = []  # (is_slot, text)
+        pos = 0
+        literal = []
+        for match in self.SLOT.finditer(source):
+            literal.append(source[pos:match.start()])
+            name = match.group(1)
+            if name in constants:
+                literal.append(constants[name])
+            else:
+                self.parts.append((False, ''.join(literal)))
+                self.parts.append((True, name))
+                literal = []
+            pos = match.end()
+        literal.append(source[pos:])
+        self.parts.append((False, ''.join(literal)))
+
+    def render(self, **values):
+        for is_slot, text in self.parts:
+            if not is_slot:
+                yield text
+                continue
+            value = values[text]
+            if isinstance(value, str):
+                yield value
+            else:
+                yield from value
+
+
+class CountingWriter:
+    """Passes writes through to the client socket, counting the bytes sent"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def __getattr__(self, name):
+        # closed, close() and the rest of the socket writer's interface
+        return getattr(self.raw, name)
+
+
+class ChunkedWriter:
+    """Coalesces small writes into STREAM_CHUNK_SIZE pieces for wfile.
+
+    With chunked=True each piece goes out as an HTTP/1.1 chunk and close()
+    writes the terminating zero-length chunk. An optional compressor is
+    applied on the way through; capture, if given, collects the bytes sent
+    (after compression, before chunk framing).
+    """
+
+    def __init__(self, wfile, chunked, compressor=None, capture=None):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.compressor = compressor
+        self.capture = capture
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if not data:
+            return
+        if self.capture is not None:
+            self.capture.append(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= STREAM_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        else:
+            self.wfile.write(data)
+
+    def close(self):
+        if self.compressor is not None:
+            tail = self.compressor.flush()
+            self.compressor = None
+            self.write(tail)
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+TREE_PAGE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>{{repo_name}} - File Browser</title>
+    <link rel="stylesheet" href="{{stylesheet}}">
+</head>
+<body>
+    <div class="container">
+        <h1>{{repo_name}}</h1>
+        
+        <div class="header">
+            <div class="branch-selector">
+                <label>Branch: </label>
+                <select onchange="window.location.href='/{{repo_name}}/tree/' + this.value + '{{path_suffix}}'">
+{{branch_options}}                </select>
+            </div>
+        </div>
+        
+        <div class="breadcrumb">
+{{breadcrumb}}        </div>
+{{listing}}
+        <div class="actions">
+            <a href="/{{repo_name}}.git">Clone Repository</a>
+            <a href="/">Back to Repository List</a>
+        </div>
+    </div>
+</body>
+</html>
+""", stylesheet=STYLESHEET_URL)
+
+TREE_ROW = Template("""            <div class="file-item">
+                <span class="file-icon">{{icon}}</span>
+                <span class="file-name"><a href="{{url}}">{{name}}</a></span>{{commit_columns}}
+            </div>
+""")
+
+TREE_COMMIT_COLUMNS = Template("""
+                <span class="file-commit" title="{{hash}}">{{message}}</span>
+                <span class="file-date">{{date}}</span>""")
+
+BLOB_PAGE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>{{file_name}} - {{repo_name}}</title>
+    <link rel="stylesheet" href="{{stylesheet}}">
+</head>
+<body>
+    <div class="container">
+        <h1>{{file_name}}</h1>
+        
+        <div class="breadcrumb">
+{{breadcrumb}}        </div>
+{{file_info}}{{body}}
+        <div class="actions">
+            <a href="{{raw_url}}">Raw</a>
+            <a href="{{tree_url}}">View Directory</a>
+            <a href="/{{repo_name}}/tree/{{branch}}">Repository Root</a>
+            <a href="/{{repo_name}}.git">Clone Repository</a>
+            <a href="/">Back to Repository List</a>
+        </div>
+    </div>
+</body>
+</html>
+""", stylesheet=STYLESHEET_URL)
+
+REPO_LIST_PAGE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>Git Repositories</title>
+    <link rel="stylesheet" href="{{stylesheet}}">
+</head>
+<body class="repo-list">
+    <div class="container">
+        <h1>Available Git Repositories</h1>
+        <ul>
+{{repos}}        </ul>
+    </div>
+</body>
+</html>""", stylesheet=STYLESHEET_URL)
+
+REPO_LIST_ROW = Template("""<li><a href="/{{repo_name}}">{{repo_name}}</a><span class="repo-actions"><a href="/{{repo_name}}.git">[Clone]</a></span></li>
+""")
+
+
+def metric_samples(admission):
+    """Metric values kept outside the registry: cache, coalescing and admission state"""
+    samples = []
+    for cache_name, cache in (('objects', object_cache), ('pages', page_cache)):
+        stats = cache.stats()
+        labels = {'cache': cache_name}
+        samples += [
+            ('git_http_cache_hits_total', labels, stats['hits']),
+            ('git_http_cache_misses_total', labels, stats['misses']),
+            ('git_http_cache_evictions_total', labels, stats['evictions']),
+            ('git_http_cache_bytes', labels, stats['bytes']),
+        ]
+    samples.append(('git_upload_pack_flights_started_total', {}, upload_pack_flights.started))
+    samples.append(('git_upload_pack_flights_joined_total', {}, upload_pack_flights.joined))
+    if admission is not None:
+        for budget_name, budget in admission.budgets():
+            labels = {'budget': budget_name}
+            samples += [
+                ('git_http_admission_active', labels, budget.active),
+                ('git_http_admission_waiting', labels, budget.waiting),
+                ('git_http_admission_shed_total', labels, budget.shed),
+            ]
+    return samples
+
+
+class BoundedThreadPoolHTTPServer(http.server.HTTPServer):
+    """HTTPServer that hands accepted connections to a fixed pool of worker threads.
+
+    Connections wait in a queue of at most max_queue entries; once that is full,
+    new connections get an immediate 503 instead of piling up behind slow clones.
+    A kept-alive connection waiting for its next request gives its worker back:
+    a selector thread watches it and queues it again once it is readable.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS,
+                 max_queue=MAX_QUEUE_DEPTH, pack_limit=MAX_PACK_PER_REPO, reuse_port=False,
+                 admission=None):
+        self.reuse_port = reuse_port
+        self.draining = False
+        super().__init__(server_address, handler_class)
+        self.repo_limiter = RepoConcurrencyLimiter(pack_limit)
+        self.admission = admission
+        self._pending = queue.Queue()
+        self._capacity = max_workers + max(max_queue, 0)
+        self._outstanding = 0   # connections queued or being served
+        self._outstanding_lock = threading.Lock()
+        self._idle_lock = threading.Lock()
+        self._idle_count = 0
+        self._parking = []      # handlers handed over by workers, not yet registered
+        self._closing = False
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f'git-http-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self.parks_idle_connections = bool(self._workers)
+        if self._workers:
+            self._selector = selectors.DefaultSelector()
+            self._wakeup_recv, self._wakeup_send = socket.socketpair()
+            self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+            self._idle_thread = threading.Thread(target=self._idle_loop, name='git-http-idle', daemon=True)
+            self._idle_thread.start()
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Several processes bind the same port; the kernel balances connections between them
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def drain(self, timeout):
+        """Stop listening and wait up to timeout seconds for in-flight connections"""
+        self.draining = True
+        self.socket.close()
+        self._wake()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._outstanding_lock:
+                if self._outstanding == 0:
+                    return
+            time.sleep(0.1)
+
+    def process_request(self, request, client_address):
+        if not self._workers:
+            super().process_request(request, client_address)
+            return
+        with self._outstanding_lock:
+            if self._outstanding >= self._capacity:
+                accepted = False
+            else:
+                self._outstanding += 1
+                accepted = True
+        if accepted:
+            self._pending.put((request, client_address, None))
+        else:
+            self._reject(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _worker_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address, handler = item
+            try:
+                if handler is None:
+                    handler = self.finish_request(request, client_address)
+                else:
+                    handler.resume()
+            except Exception:
+                handler = None
+                self.handle_error(request, client_address)
+            finally:
+                if handler is None or not handler.idle or not self._park(handler):
+                    self._close_idle(handler)
+                    self.shutdown_request(request)
+                with self._outstanding_lock:
+                    self._outstanding -= 1
+
+    def _park(self, handler):
+        """Hand an idle keep-alive connection to the selector thread"""
+        with self._idle_lock:
+            if self.draining or self._closing or self._idle_count >= MAX_IDLE_CONNECTIONS:
+                return False
+            self._idle_count += 1
+            self._parking.append(handler)
+        self._wake()
+        return True
+
+    def _wake(self):
+        if self.parks_idle_connections:
+            try:
+                self._wakeup_send.send(b'\0')
+            except OSError:
+                pass
+
+    def _close_idle(self, handler):
+        """Finish a handler that was left waiting for its next request"""
+        if handler is None or not handler.idle:
+            return
+        handler.idle = False
+        try:
+            handler.finish()
+        except OSError:
+            pass
+
+    def _idle_loop(self):
+        idle = {}   # handler -> when it is closed unless a request arrives
+        while True:
+            with self._idle_lock:
+                parking, self._parking = self._parking, []
+                closing = self._closing or self.draining
+            now = time.monotonic()
+            for handler in parking:
+                idle[handler] = now + KEEPALIVE_TIMEOUT
+                self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+            expired = [handler for handler, deadline in idle.items() if closing or deadline <= now]
+            for handler in expired:
+                del idle[handler]
+                self._selector.unregister(handler.connection)
+                self._close_idle(handler)
+                self.shutdown_request(handler.request)
+            with self._idle_lock:
+                self._idle_count -= len(expired)
+            if closing and self._closing:
+                return
+            timeout = max(min(idle.values()) - now, 0) if idle else None
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    self._wakeup_recv.recv(4096)
+                    continue
+                handler = key.data
+                del idle[handler]
+                self._selector.unregister(handler.connection)
+                with self._idle_lock:
+                    self._idle_count -= 1
+                with self._outstanding_lock:
+                    self._outstanding += 1
+                self._pending.put((handler.request, handler.client_address, handler))
+
+    def _reject(self, request):
+        """Answer 503 on a connection no worker can take right now"""
+        body = b'Server busy, please retry\n'
+        try:
+            request.sendall(
+                b'HTTP/1.0 503 Service Unavailable\r\n'
+                b'Content-Type: text/plain\r\n'
+                b'Retry-After: 5\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                b'Connection: close\r\n\r\n' + body
+            )
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        with self._idle_lock:
+            self._closing = True
+        self._wake()
+        for _ in self._workers:
+            self._pending.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+
+
 class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+    # Persistent connections: every response is framed by Content-Length or
+    # chunked encoding, or explicitly closes the connection
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, every
+    # response on a kept-alive connection would stall on a delayed ACK
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+        self.requests_handled = 0
+        self.connection_header_sent = False
+        self.request_started = None
+        self.idle = False
+    
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        self.serve_kept_alive()
+    
+    def resume(self):
+        """Serve a parked connection whose next request has arrived"""
+        self.idle = False
+        try:
+            self.serve_kept_alive()
+        finally:
+            self.finish()
+    
+    def serve_kept_alive(self):
+        """Serve requests until the connection closes, or goes idle on a server that parks it"""
+        while not self.close_connection:
+            if getattr(self.server, 'parks_idle_connections', False) and not self.request_pending():
+                # finish() is left to whoever picks the connection up again
+                self.idle = True
+                return
+            self.handle_one_request()
+    
+    def request_pending(self):
+        """Whether bytes of the next request are already buffered or waiting on the socket"""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return True     # let handle_one_request run into the error
+        finally:
+            self.connection.settimeout(KEEPALIVE_TIMEOUT)
+    
+    def finish(self):
+        if not self.idle:
+            super().finish()
+    
+    def handle_one_request(self):
+        if self.requests_handled:
+            # Waiting for the next request on a kept-alive connection
+            self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        try:
+            super().handle_one_request()
+        finally:
+            self.request_finished()
+    
+    def parse_request(self):
+        self.connection.settimeout(REQUEST_TIMEOUT)
+        self.requests_handled += 1
+        self.request_started = time.monotonic()
+        self.response_status = None
+        self.bytes_received = 0
+        self.bytes_sent_before = self.wfile.bytes_written
+        self.trace = RequestTrace() if SLOW_REQUEST_SECONDS > 0 else None
+        metrics.inc('git_http_requests_in_flight')
+        ok = super().parse_request()
+        if self.requests_handled >= MAX_REQUESTS_PER_CONNECTION or getattr(self.server, 'draining', False):
+            self.close_connection = True
+        return ok
+    
+    def send_response(self, code, message=None):
+        self.connection_header_sent = False
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def request_finished(self):
+        """Account the request parse_request started, once its response is done"""
+        if self.request_started is None:
+            return
+        elapsed = time.monotonic() - self.request_started
+        route = metrics_route(getattr(self, 'path', '') or '')
+        metrics.inc('git_http_requests_in_flight', -1)
+        metrics.inc('git_http_requests_total', route=route, code=self.response_status or 0)
+        metrics.observe('git_http_request_duration_seconds', elapsed, route=route)
+        metrics.inc('git_http_request_body_bytes_total', self.bytes_received, route=route)
+        metrics.inc('git_http_response_bytes_total', self.wfile.bytes_written - self.bytes_sent_before, route=route)
+        if self.trace is not None and elapsed >= SLOW_REQUEST_SECONDS:
+            write_slow_log(
+                f"[{self.log_date_time_string()}] slow request {elapsed:.3f}s: "
+                f"{self.requestline} -> {self.response_status} (pid {os.getpid()})\n" + self.trace.format()
+            )
+        self.request_started = None
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self.connection_header_sent = True
+        super().send_header(keyword, value)
+    
+    def end_headers(self):
+        if self.close_connection and not self.connection_header_sent:
+            self.send_header('Connection', 'close')
+        super().end_headers()
+    
+    def send_error(self, code, message=None, explain=None):
+        """Like BaseHTTPRequestHandler.send_error, but keeps the connection open.
+
+        The detail message goes into the body only, never the status line, and
+        the connection is closed only if an unread request body is left behind.
+        """
+        try:
+            shortmsg, longmsg = self.responses[code]
+        except KeyError:
+            shortmsg, longmsg = '???', '???'
+        if message is None:
+            message = shortmsg
+        if explain is None:
+            explain = longmsg
+        self.log_error("code %d, message %s", code, message.splitlines()[0] if message else '')
+        if not getattr(self, 'body_consumed', True):
+            self.close_connection = True
+        self.send_response(code)
+        body = b''
+        if code >= 200 and code not in (204, 205, 304):
+            content = self.error_message_format % {
+                'code': code,
+                'message': html.escape(message, quote=False),
+                'explain': html.escape(explain, quote=False)
+            }
+            body = content.encode('UTF-8', 'replace')
+            self.send_header('Content-Type', self.error_content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+    
+    def send_busy(self, retry_after):
+        """Shed this request with 503 and a Retry-After hint"""
+        self.send_response(503)
+        self.send_header('Retry-After', str(retry_after))
+        self.send_header('Content-Length', '0')
+        self.close_connection = True
+        self.end_headers()
+    
+    def handle_admitted_request(self):
+        """Run handle_request once the request's admission budget lets it in"""
+        admission = getattr(self.server, 'admission', None)
+        if admission is None:
+            self.handle_request()
+            return
+        path = urlparse(self.path).path
+        budget = admission.budget_for(self.command, path, shared=self.shares_upload_pack(path))
+        if budget is None:
+            self.handle_request()
+            return
+        if not budget.acquire():
+            self.send_busy(budget.retry_after)
+            return
+        try:
+            self.handle_request()
+        finally:
+            budget.release()
+    
+    def handle_traced_request(self):
+        """handle_admitted_request with this request's trace current, under cProfile if sampled"""
+        profiler = None
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        if self.trace is None and profiler is None:
+            self.handle_admitted_request()
+            return
+        _trace_local.trace = self.trace
+        started = time.monotonic()
+        try:
+            if profiler is None:
+                self.handle_admitted_request()
+            else:
+                profiler.runcall(self.handle_admitted_request)
+        finally:
+            _trace_local.trace = None
+            if profiler is not None:
+                save_profile(profiler, metrics_route(self.path), time.monotonic() - started)
+    
+    def send_body_framing(self, length=None):
+        """Send the header that delimits the body; returns True if it must be chunk-encoded"""
+        if length is not None:
+            self.send_header('Content-Length', str(length))
+            return False
+        if self.request_version >= 'HTTP/1.1':
+            self.send_header('Transfer-Encoding', 'chunked')
+            return True
+        # HTTP/1.0 client: the end of the body is the end of the connection
+        self.close_connection = True
+        return False
+    
     def do_GET(self):
-        self.handle_request()
+        self.body_consumed = True
+        self.handle_traced_request()
     
     def do_POST(self):
-        self.handle_request()
+        self.body_consumed = self.headers.get('Content-Length', '0') == '0' and 'Transfer-Encoding' not in self.headers
+        self.handle_traced_request()
+        if not self.body_consumed:
+            # Leftover request bytes would be parsed as the next request
+            self.close_connection = True
     
+    @traced
     def get_repo_branches(self, repo_path):
-        """Get list of branches in repository"""
+        """Get list of branches in repository (cached until its refs change)"""
+        return list(ref_cache.get(repo_path, 'branches', lambda: self.list_repo_branches(repo_path)))
+    
+    @traced
+    def get_default_branch(self, repo_path):
+        """Get default branch name (cached until its refs change)"""
+        return ref_cache.get(repo_path, 'default_branch', lambda: self.find_default_branch(repo_path))
+    
+    def list_repo_branches(self, repo_path):
+        """Read list of branches in repository"""
         try:
-            result = subprocess.run(
-                ['git', '--git-dir', repo_path, 'branch', '-a'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                branches = []
-                for line in result.stdout.split('\n'):
-                    line = line.strip()
-                    if line and not line.startswith('*'):
-                        branch = line.replace('remotes/origin/', '').replace('remotes/', '')
-                        if branch not in branches:
-                            branches.append(branch)
-                return branches if branches else ['main', 'master']
-            return ['main', 'master']
+            branches = []
+            for ref in sorted(read_refs(repo_path, 'refs/heads/')):
+                branches.append(ref[len('refs/heads/'):])
+            for ref in sorted(read_refs(repo_path, 'refs/remotes/')):
+                branch = ref[len('refs/remotes/'):]
+                if branch.startswith('origin/'):
+                    branch = branch[len('origin/'):]
+                if branch != 'HEAD' and branch not in branches:
+                    branches.append(branch)
+            return branches if branches else ['main', 'master']
         except:
             return ['main', 'master']
     
-    def get_default_branch(self, repo_path):
-        """Get default branch name"""
+    def find_default_branch(self, repo_path):
+        """Work out default branch name"""
         try:
-            result = subprocess.run(
-                ['git', '--git-dir', repo_path, 'symbolic-ref', 'refs/remotes/origin/HEAD'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                branch = result.stdout.strip().replace('refs/remotes/origin/', '')
-                return branch if branch else 'main'
+            origin_head = os.path.join(repo_path, 'refs', 'remotes', 'origin', 'HEAD')
+            if os.path.exists(origin_head):
+                with open(origin_head, 'r') as f:
+                    target = f.read().strip()
+                if target.startswith('ref:'):
+                    branch = target[4:].strip().replace('refs/remotes/origin/', '')
+                    return branch if branch else 'main'
             
             # Try to get main or master
             for branch in ['main', 'master']:
-                result = subprocess.run(
-                    ['git', '--git-dir', repo_path, 'show-ref', f'refs/heads/{branch}'],
-                    capture_output=True,
-                    timeout=5
-                )
-                if result.returncode == 0:
+                if catfile_pool.query(repo_path, 'batch-check', f'refs/heads/{branch}'):
                     return branch
             return 'main'
         except:
             return 'main'
     
+    @traced
+    def resolve_commit(self, repo_path, branch):
+        """Resolve a branch, tag or sha to a commit sha (cached until refs change)"""
+        def lookup():
+            obj = catfile_pool.query(repo_path, 'batch-check', f'{branch}^{{commit}}')
+            return obj[0] if obj is not None else None
+        return ref_cache.get(repo_path, ('commit', branch), lookup)
+    
+    @traced
+    def resolve_object(self, repo_path, branch, path=''):
+        """Resolve branch plus path to (sha, type, size), or None if it does not exist.
+
+        The branch is first pinned to a commit sha; (commit, path) never changes
+        meaning, so the result is cached content-addressed.
+        """
+        commit = self.resolve_commit(repo_path, branch)
+        if commit is None:
+            return None
+        key = ('path', commit, path)
+        obj = object_cache.get(key)
+        if obj is None:
+            spec = f'{commit}:{path}' if path else f'{commit}^{{tree}}'
+            result = catfile_pool.query(repo_path, 'batch-check', spec)
+            if result is None:
+                return None
+            obj = result[:3]
+            object_cache.put(key, obj, 200 + len(path))
+        return obj
+    
+    @traced
+    def read_object(self, repo_path, sha, obj_type):
+        """Read an object's raw content by sha, from memory when possible"""
+        key = (obj_type, sha)
+        data = object_cache.get(key)
+        if data is None:
+            obj = catfile_pool.query(repo_path, 'batch', sha)
+            if obj is None or obj[1] != obj_type:
+                return None
+            data = obj[3]
+            size = obj[2] + 64
+            if obj_type == 'tree':
+                data = parse_tree(data)
+                size = 64 + sum(TREE_ENTRY_BYTES + len(name) for _, _, name in data)
+            object_cache.put(key, data, size)
+        return data
+    
+    @traced
     def get_file_tree(self, repo_path, branch, path=''):
         """Get file tree for a given path in repository"""
         try:
-            # Use ls-tree with format to get type and name
-            if path:
-                git_path = f'{branch}:{path}'
-            else:
-                git_path = branch
-            
-            result = subprocess.run(
-                ['git', '--git-dir', repo_path, 'ls-tree', git_path],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
+            obj = self.resolve_object(repo_path, branch, path)
+            if obj is None or obj[1] != 'tree':
+                return []
             
-            if result.returncode != 0:
+            entries = self.read_object(repo_path, obj[0], 'tree')
+            if entries is None:
                 return []
             
             items = []
-            for line in result.stdout.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Format: mode type object name
-                # Example: 100644 blob abc123... file.txt
-                #          040000 tree def456... directory/
-                parts = line.split(None, 3)
-                if len(parts) < 4:
-                    continue
-                
-                mode, obj_type, obj_hash, item_name = parts
+            for mode, obj_hash, item_name in entries:
                 full_path = os.path.join(path, item_name) if path else item_name
                 
-                if obj_type == 'tree' or mode.startswith('04'):
+                if mode == '40000':
                     # It's a directory
                     items.append({
                         'name': item_name + '/',
@@ -127,36 +2735,101 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         except Exception as e:
             return []
     
+    @traced
     def get_file_content(self, repo_path, branch, file_path):
-        """Get content of a file from repository"""
+        """Get content of a file from repository (None for binaries)"""
         try:
-            git_path = f'{branch}:{file_path}'
-            result = subprocess.run(
-                ['git', '--git-dir', repo_path, 'show', git_path],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
+            obj = self.resolve_object(repo_path, branch, file_path)
+            if obj is None or obj[1] != 'blob':
+                return None
+            if self.is_binary_blob(repo_path, obj[0], obj[2]):
+                return None
             
-            if result.returncode == 0:
-                return result.stdout
+            data = self.read_object(repo_path, obj[0], 'blob')
+            if data is not None:
+                return data.decode('utf-8')
             return None
         except:
             return None
     
+    @traced
+    def is_binary_blob(self, repo_path, sha, size):
+        """Sniff the first BINARY_SNIFF_BYTES of a blob for NUL bytes; the verdict is cached by sha"""
+        key = ('binary', sha)
+        verdict = object_cache.get(key)
+        if verdict is None:
+            if size == 0:
+                head = b''
+            elif size <= SNIFF_FULL_READ_BYTES:
+                head = (self.read_object(repo_path, sha, 'blob') or b'')[:BINARY_SNIFF_BYTES]
+            else:
+                head = b''.join(self.stream_blob(repo_path, sha, size, 0, BINARY_SNIFF_BYTES - 1))
+            verdict = b'\0' in head
+            object_cache.put(key, verdict, 64)
+        return verdict
+    
+    @traced
+    def stream_blob(self, repo_path, sha, size, start=0, end=None):
+        """Yield bytes start..end (inclusive) of a blob without holding it all in memory"""
+        if end is None:
+            end = size - 1
+        data = object_cache.get(('blob', sha))
+        if data is not None:
+            for pos in range(start, end + 1, STREAM_CHUNK_SIZE):
+                yield data[pos:min(pos + STREAM_CHUNK_SIZE, end + 1)]
+            return
+        
+        process = GitProcess(
+            ['git', '--git-dir', repo_path, 'cat-file', 'blob', sha],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            pos = 0
+            while pos <= end:
+                chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunk_end = pos + len(chunk)
+                if chunk_end > start:
+                    yield chunk[max(start - pos, 0):min(end + 1 - pos, len(chunk))]
+                pos = chunk_end
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+    
+    @traced
+    def read_blob_range(self, repo_path, sha, size, start, length):
+        """Read up to length bytes of a blob from start; small blobs go through the object cache"""
+        if size <= object_cache.max_item_bytes:
+            data = self.read_object(repo_path, sha, 'blob')
+            return data[start:start + length] if data is not None else None
+        end = min(start + length, size) - 1
+        return b''.join(self.stream_blob(repo_path, sha, size, start, end))
+    
+    @traced
     def get_file_info(self, repo_path, branch, file_path):
         """Get file information (size, last commit, etc.)"""
         try:
-            git_path = f'{branch}:{file_path}'
-            result = subprocess.run(
-                ['git', '--git-dir', repo_path, 'log', '-1', '--format=%H|%an|%ae|%ad|%s', '--date=iso', '--', git_path],
+            commit = self.resolve_commit(repo_path, branch)
+            if commit is None:
+                return None
+            index = last_commit_index.get(repo_path, branch, commit)
+            if index is not None:
+                return last_commit_index.lookup(index, file_path)
+            
+            # Index still building: ask git directly
+            result = run_git(
+                ['git', '--git-dir', repo_path, 'log', '-1', '--format=%H|%an|%ae|%ad|%s', '--date=iso', commit, '--', file_path],
                 capture_output=True,
                 text=True,
                 timeout=10
             )
             
             if result.returncode == 0 and result.stdout.strip():
-                parts = result.stdout.strip().split('|')
+                parts = result.stdout.strip().split('|', 4)
                 if len(parts) >= 5:
                     return {
                         'hash': parts[0],
@@ -169,8 +2842,23 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         except:
             return None
     
+    @traced
+    def get_last_commits(self, repo_path, branch, items):
+        """Map item path -> last commit info for a tree listing; empty until the index is built"""
+        commit = self.resolve_commit(repo_path, branch)
+        index = last_commit_index.get(repo_path, branch, commit) if commit else None
+        if index is None:
+            return {}
+        last_commits = {}
+        for item in items:
+            info = last_commit_index.lookup(index, item['path'])
+            if info is not None:
+                last_commits[item['path']] = info
+        return last_commits
+    
+    @traced
     def render_repo_browser(self, repo_name, repo_path, branch=None, path=''):
-        """Render repository file browser"""
+        """Render repository file browser as a stream of HTML fragments"""
         if branch is None:
             branch = self.get_default_branch(repo_path)
         
@@ -178,6 +2866,7 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
         
         # Get file tree
         items = self.get_file_tree(repo_path, branch, path)
+        last_commits = self.get_last_commits(repo_path, branch, items)
         
         # Build breadcrumb
         breadcrumb = [{'name': repo_name, 'url': f'/{repo_name}/tree/{branch}'}]
@@ -192,224 +2881,86 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
                 })
         
         path_suffix = '/' + html.escape(path) if path else ''
-        html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <title>{html.escape(repo_name)} - File Browser</title>
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Helvetica, Arial, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background: #f6f8fa;
-            color: #24292e;
-        }}
-        .container {{
-            max-width: 1200px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 6px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.12);
-            padding: 20px;
-        }}
-        h1 {{
-            margin: 0 0 20px 0;
-            font-size: 24px;
-            border-bottom: 1px solid #eaecef;
-            padding-bottom: 10px;
-        }}
-        .header {{
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 20px;
-            flex-wrap: wrap;
-        }}
-        .breadcrumb {{
-            margin-bottom: 15px;
-        }}
-        .breadcrumb a {{
-            color: #0366d6;
-            text-decoration: none;
-        }}
-        .breadcrumb a:hover {{
-            text-decoration: underline;
-        }}
-        .breadcrumb span {{
-            margin: 0 5px;
-            color: #586069;
-        }}
-        .branch-selector {{
-            margin-bottom: 15px;
-        }}
-        .branch-selector select {{
-            padding: 5px 10px;
-            border: 1px solid #d1d5da;
-            border-radius: 3px;
-            font-size: 14px;
-        }}
-        .file-list {{
-            border: 1px solid #e1e4e8;
-            border-radius: 3px;
-        }}
-        .file-item {{
-            display: flex;
-            align-items: center;
-            padding: 8px 16px;
-            border-bottom: 1px solid #eaecef;
-        }}
-        .file-item:last-child {{
-            border-bottom: none;
-        }}
-        .file-item:hover {{
-            background: #f6f8fa;
-        }}
-        .file-icon {{
-            margin-right: 8px;
-            width: 16px;
-            text-align: center;
-        }}
-        .file-name {{
-            flex: 1;
-        }}
-        .file-name a {{
-            color: #0366d6;
-            text-decoration: none;
-        }}
-        .file-name a:hover {{
-            text-decoration: underline;
-        }}
-        .file-actions {{
-            margin-left: 10px;
-        }}
-        .file-actions a {{
-            color: #586069;
-            text-decoration: none;
-            margin-left: 10px;
-        }}
-        .file-actions a:hover {{
-            color: #0366d6;
-        }}
-        .file-content {{
-            background: #f6f8fa;
-            border: 1px solid #e1e4e8;
-            border-radius: 3px;
-            padding: 16px;
-            overflow-x: auto;
-        }}
-        .file-content pre {{
-            margin: 0;
-            font-family: 'SFMono-Regular', Consolas, 'Liberation Mono', Menlo, monospace;
-            font-size: 12px;
-            line-height: 1.45;
-        }}
-        .file-info {{
-            background: #f6f8fa;
-            border: 1px solid #e1e4e8;
-            border-radius: 3px;
-            padding: 10px;
-            margin-bottom: 15px;
-            font-size: 12px;
-            color: #586069;
-        }}
-        .actions {{
-            margin-top: 20px;
-            padding-top: 20px;
-            border-top: 1px solid #eaecef;
-        }}
-        .actions a {{
-            color: #0366d6;
-            text-decoration: none;
-            margin-right: 15px;
-        }}
-        .actions a:hover {{
-            text-decoration: underline;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>{html.escape(repo_name)}</h1>
-        
-        <div class="header">
-            <div class="branch-selector">
-                <label>Branch: </label>
-                <select onchange="window.location.href='/{html.escape(repo_name)}/tree/' + this.value + '{path_suffix}'">
-"""
-        for b in branches:
-            selected = 'selected' if b == branch else ''
-            html_content += f'                    <option value="{html.escape(b)}" {selected}>{html.escape(b)}</option>\n'
-        
-        html_content += f"""
-                </select>
-            </div>
-        </div>
         
-        <div class="breadcrumb">
-"""
-        for i, crumb in enumerate(breadcrumb):
-            if i > 0:
-                html_content += '            <span>/</span>\n'
-            html_content += f'            <a href="{crumb["url"]}">{html.escape(crumb["name"])}</a>\n'
+        def branch_options():
+            for b in branches:
+                selected = 'selected' if b == branch else ''
+                yield f'                    <option value="{html.escape(b)}" {selected}>{html.escape(b)}</option>\n'
         
-        html_content += """
-        </div>
+        def listing():
+            if not items:
+                yield """
+        <p>No files found in this directory.</p>
 """
-        
-        if items:
-            html_content += """
+                return
+            yield """
         <div class="file-list">
 """
             for item in items:
-                icon = '📁' if item['type'] == 'directory' else '📄'
-                if item['type'] == 'directory':
-                    url = f'/{repo_name}/tree/{branch}/{item["path"]}'
-                    html_content += f"""
-            <div class="file-item">
-                <span class="file-icon">{icon}</span>
-                <span class="file-name"><a href="{url}">{html.escape(item["name"])}</a></span>
-            </div>
-"""
+                is_dir = item['type'] == 'directory'
+                view = 'tree' if is_dir else 'blob'
+                commit_info = last_commits.get(item['path'])
+                if commit_info:
+                    commit_columns = TREE_COMMIT_COLUMNS.render(
+                        hash=html.escape(commit_info['hash']),
+                        message=html.escape(commit_info['message']),
+                        date=html.escape(commit_info['date'][:10])
+                    )
                 else:
-                    view_url = f'/{repo_name}/blob/{branch}/{item["path"]}'
-                    html_content += f"""
-            <div class="file-item">
-                <span class="file-icon">{icon}</span>
-                <span class="file-name"><a href="{view_url}">{html.escape(item["name"])}</a></span>
-            </div>
-"""
-            html_content += """
-        </div>
-"""
-        else:
-            html_content += """
-        <p>No files found in this directory.</p>
+                    commit_columns = ''
+                yield from TREE_ROW.render(
+                    icon='📁' if is_dir else '📄',
+                    url=html.escape(f'/{repo_name}/{view}/{branch}/{item["path"]}'),
+                    name=html.escape(item['name']),
+                    commit_columns=commit_columns
+                )
+            yield """        </div>
 """
         
-        html_content += f"""
-        <div class="actions">
-            <a href="/{repo_name}.git">Clone Repository</a>
-            <a href="/">Back to Repository List</a>
-        </div>
-    </div>
-</body>
-</html>
-"""
-        return html_content
+        return TREE_PAGE.render(
+            repo_name=html.escape(repo_name),
+            path_suffix=path_suffix,
+            branch_options=branch_options(),
+            breadcrumb=self.render_breadcrumb(breadcrumb),
+            listing=listing()
+        )
+    
+    def render_breadcrumb(self, breadcrumb):
+        for i, crumb in enumerate(breadcrumb):
+            if i > 0:
+                yield '            <span>/</span>\n'
+            if crumb['url']:
+                yield f'            <a href="{html.escape(crumb["url"])}">{html.escape(crumb["name"])}</a>\n'
+            else:
+                yield f'            <span>{html.escape(crumb["name"])}</span>\n'
     
-    def render_file_view(self, repo_name, repo_path, branch, file_path):
-        """Render file content view"""
-        content = self.get_file_content(repo_path, branch, file_path)
+    @traced
+    def render_file_view(self, repo_name, repo_path, branch, file_path, offset=0):
+        """Render file content view, showing at most PREVIEW_BYTES from offset"""
+        obj = self.resolve_object(repo_path, branch, file_path)
         file_info = self.get_file_info(repo_path, branch, file_path)
+        commit = self.resolve_commit(repo_path, branch)
         
-        # Determine if file is binary or text
+        # Size and type come from the object header; binaries are flagged from a
+        # short prefix before any page of content is read
+        content = None
+        size = 0
+        next_offset = None
         is_binary = False
-        if content:
-            try:
-                content.encode('utf-8')
-            except:
-                is_binary = True
+        if obj is not None and obj[1] == 'blob':
+            size = obj[2]
+            is_binary = self.is_binary_blob(repo_path, obj[0], size)
+            if not is_binary:
+                offset = min(max(offset, 0), size)
+                window = self.read_blob_range(repo_path, obj[0], size, offset, PREVIEW_BYTES)
+                if window is not None:
+                    if offset + len(window) < size:
+                        # End the page on a line boundary so the next one starts cleanly
+                        cut = window.rfind(b'\n')
+                        if cut != -1:
+                            window = window[:cut + 1]
+                        next_offset = offset + len(window)
+                    content = window.decode('utf-8', errors='replace')
         
         # Build breadcrumb
         breadcrumb = [{'name': repo_name, 'url': f'/{repo_name}/tree/{branch}'}]
@@ -419,156 +2970,757 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
             current_path = os.path.join(current_path, part) if current_path else part
             breadcrumb.append({
                 'name': part,
-                'url': f'/{repo_name}/tree/{branch}/{current_path}'
-            })
-        breadcrumb.append({'name': path_parts[-1], 'url': ''})
-        
-        html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <title>{html.escape(path_parts[-1])} - {html.escape(repo_name)}</title>
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Helvetica, Arial, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background: #f6f8fa;
-            color: #24292e;
-        }}
-        .container {{
-            max-width: 1200px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 6px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.12);
-            padding: 20px;
-        }}
-        h1 {{
-            margin: 0 0 20px 0;
-            font-size: 24px;
-            border-bottom: 1px solid #eaecef;
-            padding-bottom: 10px;
-        }}
-        .breadcrumb {{
-            margin-bottom: 15px;
-        }}
-        .breadcrumb a {{
-            color: #0366d6;
-            text-decoration: none;
-        }}
-        .breadcrumb a:hover {{
-            text-decoration: underline;
-        }}
-        .breadcrumb span {{
-            margin: 0 5px;
-            color: #586069;
-        }}
-        .file-info {{
-            background: #f6f8fa;
-            border: 1px solid #e1e4e8;
-            border-radius: 3px;
-            padding: 10px;
-            margin-bottom: 15px;
-            font-size: 12px;
-            color: #586069;
-        }}
-        .file-content {{
-            background: #ffffff;
-            border: 1px solid #e1e4e8;
-            border-radius: 3px;
-            overflow: hidden;
-        }}
-        .file-content pre {{
-            margin: 0;
-            padding: 16px;
-            font-family: 'SFMono-Regular', Consolas, 'Liberation Mono', Menlo, monospace;
-            font-size: 12px;
-            line-height: 1.45;
-            overflow-x: auto;
-            background: #ffffff;
-        }}
-        .file-content code {{
-            white-space: pre;
-        }}
-        .actions {{
-            margin-top: 20px;
-            padding-top: 20px;
-            border-top: 1px solid #eaecef;
-        }}
-        .actions a {{
-            color: #0366d6;
-            text-decoration: none;
-            margin-right: 15px;
-        }}
-        .actions a:hover {{
-            text-decoration: underline;
-        }}
-        .binary-warning {{
-            padding: 20px;
-            text-align: center;
-            color: #586069;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>{html.escape(path_parts[-1])}</h1>
-        
-        <div class="breadcrumb">
-"""
-        for i, crumb in enumerate(breadcrumb):
-            if i > 0:
-                html_content += '            <span>/</span>\n'
-            if crumb['url']:
-                html_content += f'            <a href="{crumb["url"]}">{html.escape(crumb["name"])}</a>\n'
-            else:
-                html_content += f'            <span>{html.escape(crumb["name"])}</span>\n'
-        
-        html_content += """
-        </div>
-"""
+                'url': f'/{repo_name}/tree/{branch}/{current_path}'
+            })
+        breadcrumb.append({'name': path_parts[-1], 'url': ''})
         
+        info_html = ''
         if file_info:
-            html_content += f"""
+            info_html = f"""
         <div class="file-info">
             <strong>Last modified:</strong> {html.escape(file_info.get('date', 'Unknown'))} by {html.escape(file_info.get('author', 'Unknown'))}<br>
             <strong>Commit:</strong> {html.escape(file_info.get('hash', '')[:8])} - {html.escape(file_info.get('message', ''))}
         </div>
 """
         
-        if is_binary or not content:
-            html_content += """
+        raw_url = f'/{repo_name}/raw/{commit or branch}/{file_path}'
+        if is_binary or content is None:
+            body = [f"""
         <div class="binary-warning">
             <p>Binary file or file not found. Cannot display content.</p>
+            {f'<p><a href="{html.escape(raw_url)}">Download ({size} bytes)</a></p>' if is_binary else ''}
         </div>
-"""
+"""]
         else:
-            escaped_content = html.escape(content)
-            html_content += f"""
+            body = ["""
         <div class="file-content">
-            <pre><code>{escaped_content}</code></pre>
+            <pre><code>""", html.escape(content), """</code></pre>
         </div>
-"""
+"""]
+            if offset > 0 or next_offset is not None:
+                shown_end = next_offset if next_offset is not None else size
+                body.append(f"""
+        <div class="file-info">
+            Showing bytes {offset}-{shown_end} of {size}.
+            {f'<a href="?offset={next_offset}">Load more</a>' if next_offset is not None else ''}
+        </div>
+""")
         
         dir_path = '/'.join(path_parts[:-1])
         tree_url = f'/{repo_name}/tree/{branch}'
         if dir_path:
             tree_url += f'/{dir_path}'
         
-        html_content += f"""
-        <div class="actions">
-            <a href="{tree_url}">View Directory</a>
-            <a href="/{repo_name}/tree/{branch}">Repository Root</a>
-            <a href="/{repo_name}.git">Clone Repository</a>
-            <a href="/">Back to Repository List</a>
-        </div>
-    </div>
-</body>
-</html>
-"""
-        return html_content
+        return BLOB_PAGE.render(
+            file_name=html.escape(path_parts[-1]),
+            repo_name=html.escape(repo_name),
+            branch=html.escape(branch),
+            breadcrumb=self.render_breadcrumb(breadcrumb),
+            file_info=info_html,
+            body=body,
+            raw_url=html.escape(raw_url),
+            tree_url=html.escape(tree_url)
+        )
+    
+    @traced
+    def render_repo_list(self):
+        """Render the list of repositories under GIT_REPO_DIR"""
+        def rows():
+            if os.path.exists(GIT_REPO_DIR):
+                repos = [d for d in os.listdir(GIT_REPO_DIR) 
+                        if os.path.isdir(os.path.join(GIT_REPO_DIR, d)) and d.endswith('.git')]
+                for repo in sorted(repos):
+                    yield from REPO_LIST_ROW.render(repo_name=html.escape(repo[:-len('.git')]))
+        
+        return REPO_LIST_PAGE.render(repos=rows())
+    
+    def negotiate_encoding(self, offered=None):
+        return negotiate_encoding(self.headers.get('Accept-Encoding'), offered)
+    
+    @traced
+    def send_page(self, chunks, etag=None, encoding=None):
+        """Stream an HTML page to the client as it is rendered.
+
+        HTTP/1.1 clients get chunked transfer encoding; HTTP/1.0 clients get the
+        body delimited by connection close. The body is compressed on the fly
+        when encoding is set. Returns {encoding or 'identity': bytes} for the
+        page cache when the page is small enough, else None.
+        """
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if etag is not None:
+            self.send_header('ETag', encoded_etag(etag, encoding))
+            self.send_header('Cache-Control', 'no-cache')
+        chunked = self.send_body_framing()
+        self.end_headers()
+        
+        captured = [] if etag is not None else None
+        encoded = [] if etag is not None and encoding is not None else None
+        writer = ChunkedWriter(self.wfile, chunked, make_compressor(encoding), encoded)
+        captured_size = 0
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            writer.write(data)
+            if captured is not None:
+                captured.append(data)
+                captured_size += len(data)
+                if captured_size > page_cache.max_item_bytes:
+                    captured = encoded = writer.capture = None
+        writer.close()
+        if captured is None:
+            return None
+        variants = {'identity': b''.join(captured)}
+        if encoded is not None:
+            variants[encoding] = b''.join(encoded)
+        return variants
+    
+    @traced
+    def send_cached_page(self, page, etag, encoding=None):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(page)))
+        self.send_header('ETag', encoded_etag(etag, encoding))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(page)
+    
+    def serve_stylesheet(self):
+        # Only a gzip copy is kept, so zstd-only clients get identity
+        gzipped = self.negotiate_encoding(offered=('gzip',)) == 'gzip'
+        body = STYLESHEET_GZIP if gzipped else STYLESHEET_BYTES
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/css; charset=utf-8')
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def parse_byte_range(self, size):
+        """(start, end, status) for a single Range header over size bytes.
+
+        Answers 416 itself and returns None when the range cannot be satisfied;
+        anything malformed is ignored and the whole body is sent with a 200.
+        """
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if not range_header or size <= 0:
+            return start, end, 200
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return start, end, 200
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start = max(size - int(match.group(2)), 0)
+        if start >= size or start > end:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        return start, end, 206
+    
+    def not_modified_since(self, mtime):
+        """Check If-Modified-Since against a file mtime"""
+        header = self.headers.get('If-Modified-Since')
+        if not header:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return False
+        return since is not None and int(mtime) <= since.timestamp()
+    
+    def serve_metrics(self):
+        """Prometheus scrape endpoint: request metrics plus cache, coalescing and admission state.
+
+        With --workers, the values are summed over every worker process.
+        """
+        values = shared_metrics.gather(metrics.collect(metric_samples(getattr(self.server, 'admission', None))))
+        # Ratios do not add up across processes, so they come from the summed counts
+        for key, hits in values['git_http_cache_hits_total'].items():
+            lookups = hits + values['git_http_cache_misses_total'].get(key, 0)
+            values['git_http_cache_hit_ratio'][key] = hits / lookups if lookups else 0
+        body = metrics.render(values).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    @traced
+    def serve_static_file(self, root, relative_path, content_type, cache_control):
+        """Send a file under root straight from the page cache with sendfile(2).
+
+        Honours If-None-Match, If-Modified-Since and a single Range; anything
+        that resolves outside root (.., symlinks) is answered with 404.
+        """
+        root = os.path.realpath(root)
+        full_path = os.path.realpath(os.path.join(root, relative_path))
+        if os.path.commonpath([root, full_path]) != root:
+            self.send_error(404, "File not found")
+            return
+        try:
+            f = open(full_path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                self.send_error(404, "File not found")
+                return
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+            if 'If-None-Match' in self.headers:
+                not_modified = self.etag_matches(etag)
+            else:
+                not_modified = self.not_modified_since(st.st_mtime)
+            if not_modified:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+            
+            byte_range = self.parse_byte_range(size)
+            if byte_range is None:
+                return
+            start, end, status = byte_range
+            
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(end - start + 1 if size else 0))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', cache_control)
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if size:
+                # socket.sendfile() uses os.sendfile and copes with the socket timeout
+                self.wfile.bytes_written += self.connection.sendfile(f, start, end - start + 1)
+    
+    @traced
+    def serve_raw_blob(self, repo_path, ref, file_path):
+        """Stream a blob's bytes, honouring If-None-Match and a single Range"""
+        obj = self.resolve_object(repo_path, ref, file_path)
+        if obj is None or obj[1] != 'blob':
+            self.send_error(404, "File not found")
+            return
+        sha, _, size = obj
+        etag = f'"{sha}"'
+        # A commit sha pins the blob forever; branch names can move
+        if re.fullmatch(r'[0-9a-f]{40}', ref):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        
+        if self.etag_matches(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
+        
+        byte_range = self.parse_byte_range(size)
+        if byte_range is None:
+            return
+        start, end, status = byte_range
+        
+        content_type, _ = mimetypes.guess_type(file_path)
+        if content_type is None or content_type in ('text/html', 'image/svg+xml', 'application/xhtml+xml'):
+            # Never let repository content run as a page on this origin
+            content_type = 'application/octet-stream'
+        elif content_type.startswith('text/'):
+            content_type = 'text/plain; charset=utf-8'
+        
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1 if size else 0))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('X-Content-Type-Options', 'nosniff')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if size:
+            for chunk in self.stream_blob(repo_path, sha, size, start, end):
+                self.wfile.write(chunk)
+    
+    @traced
+    def browser_page_etag(self, view_type, repo_name, repo_path, branch, path, variant=''):
+        """Strong ETag for a tree/blob page, or None if the object does not resolve.
+
+        The page is a function of the resolved commit and object ids plus the
+        names that appear in it (repository, branch, path and, for tree views,
+        the branch selector), so hashing those identifies the rendered bytes.
+        """
+        commit = self.resolve_commit(repo_path, branch)
+        obj = self.resolve_object(repo_path, branch, path)
+        if commit is None or obj is None:
+            return None
+        parts = [view_type, repo_name, branch, path, commit, obj[0], variant]
+        if view_type == 'tree':
+            # Last-commit columns appear once the branch's index is built
+            index = last_commit_index.get(repo_path, branch, commit)
+            parts.append('indexed' if index is not None else 'unindexed')
+            parts.extend(self.get_repo_branches(repo_path))
+        digest = hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+        return f'"{view_type}-{obj[0][:12]}-{digest}"'
+    
+    def public_url(self, path):
+        """Absolute URL for path as the client addressed us (ngrok sets X-Forwarded-Proto)"""
+        scheme = self.headers.get('X-Forwarded-Proto', 'http').split(',')[0].strip()
+        host = self.headers.get('Host') or f'localhost:{SERVER_PORT}'
+        return f'{scheme}://{host}{path}'
+    
+    def etag_matches(self, etag):
+        """Check If-None-Match against etag"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        for candidate in header.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == '*' or candidate == etag:
+                return True
+        return False
+    
+    @traced
+    def serve_cached_advertisement(self, repo_path, service, cmd, env):
+        """Serve a v0/v1 info/refs advertisement from the ref cache.
+
+        The advertisement only changes when refs (or config) do, so it is
+        generated once per ref-state fingerprint and then served from memory,
+        with compressed variants kept alongside. Returns False when there is
+        nothing cacheable and the request should go to git-http-backend.
+        """
+        git_protocol = env.get('HTTP_GIT_PROTOCOL', '')
+        
+        def generate():
+            result = run_git(cmd, env=env, cwd=GIT_REPO_DIR, stdin=subprocess.DEVNULL, capture_output=True)
+            if result.returncode != 0:
+                return None
+            output = result.stdout
+            separator = b'\r\n\r\n' if b'\r\n\r\n' in output else b'\n\n'
+            header_block, found, body = output.partition(separator)
+            if not found:
+                return None
+            status_code, headers = parse_cgi_headers(header_block.decode('utf-8', errors='ignore').split('\n'))
+            if status_code != 200:
+                return None
+            headers = [(k, v) for k, v in headers if k != 'content-length']
+            return {'headers': headers, 'variants': {None: body}, 'lock': threading.Lock()}
+        
+        entry = ref_cache.get(repo_path, ('advertisement', service, git_protocol), generate)
+        if entry is None:
+            return False
+        
+        encoding = self.negotiate_encoding()
+        with entry['lock']:
+            body = entry['variants'].get(encoding)
+            if body is None:
+                body = entry['variants'][encoding] = compress_bytes(entry['variants'][None], encoding)
+        
+        self.send_response(200)
+        for key, value in entry['headers']:
+            self.send_header(key, value)
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+    
+    def relay_cgi_response(self, stdout):
+        """Relay a CGI response read from stdout (readline/read1) to the client.
+
+        Returns False, having sent nothing, if stdout ended before the headers did.
+        """
+        # Parse CGI response headers (terminated by an empty line)
+        header_lines = []
+        headers_complete = False
+        while True:
+            line = stdout.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', errors='ignore').strip()
+            if not line:
+                headers_complete = True
+                break
+            header_lines.append(line)
+        if not headers_complete:
+            return False
+        
+        # Relay body (may be binary) as it is produced; flush every read so
+        # sideband progress reaches the client without delay
+        writer = self.start_cgi_response(header_lines)
+        for chunk in iter(lambda: stdout.read1(STREAM_CHUNK_SIZE), b''):
+            writer.write(chunk)
+            writer.flush()
+        writer.close()
+        return True
+    
+    def start_cgi_response(self, header_lines):
+        """Send the status and headers of a CGI response; returns the body writer"""
+        status_code, headers = parse_cgi_headers(header_lines)
+        
+        # Compress ref advertisements (not pack data) when the client accepts it
+        content_type = next((v for k, v in headers if k == 'content-type'), '')
+        encoding = None
+        if content_type.startswith(COMPRESSIBLE_TYPES) and not any(k == 'content-encoding' for k, v in headers):
+            encoding = self.negotiate_encoding()
+            if encoding is not None:
+                headers = [(k, v) for k, v in headers if k != 'content-length']
+                headers.append(('Content-Encoding', encoding))
+                headers.append(('Vary', 'Accept-Encoding'))
+        
+        # Send response
+        content_length_header = next((v for k, v in headers if k == 'content-length'), None)
+        self.send_response(status_code)
+        for key, value in headers:
+            if key != 'content-length':
+                self.send_header(key, value)
+        chunked = self.send_body_framing(content_length_header)
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked, make_compressor(encoding))
+    
+    def git_backend_env(self, path, query, repo_name):
+        """CGI environment for running git-http-backend on this request"""
+        env = os.environ.copy()
+        env['GIT_PROJECT_ROOT'] = GIT_REPO_DIR
+        env['GIT_HTTP_EXPORT_ALL'] = '1'
+        env['REQUEST_METHOD'] = self.command
+        env['PATH_INFO'] = '/' + path.lstrip('/')
+        env['QUERY_STRING'] = query
+        env['CONTENT_TYPE'] = self.headers.get('Content-Type', '')
+        env['CONTENT_LENGTH'] = self.headers.get('Content-Length', '0')
+        if 'Transfer-Encoding' in self.headers or self.headers.get('Content-Encoding'):
+            # The body is decoded on its way in, so its final length is
+            # unknown; git-http-backend then reads stdin to EOF
+            del env['CONTENT_LENGTH']
+        env.pop('HTTP_CONTENT_ENCODING', None)
+        env['HTTP_USER_AGENT'] = self.headers.get('User-Agent', '')
+        if self.headers.get('Git-Protocol'):
+            # Lets protocol v2 clients use ls-refs with ref-prefix filtering
+            env['HTTP_GIT_PROTOCOL'] = self.headers['Git-Protocol']
+        if (BUNDLE_URIS and 'version=2' in env.get('HTTP_GIT_PROTOCOL', '')
+                and ('git-upload-pack' in path or 'git-upload-pack' in query)
+                and clone_bundles.available(repo_name)):
+            # Offer the precomputed bundle to clients that understand bundle-uri
+            add_git_config_env(env, [
+                ('uploadpack.advertiseBundleURIs', 'true'),
+                ('bundle.version', '1'),
+                ('bundle.mode', 'all'),
+                ('bundle.clone.uri', self.public_url(f'/{repo_name}/clone.bundle')),
+            ])
+        return env
     
+    def declared_body_too_large(self):
+        """Whether Content-Length alone already exceeds MAX_REQUEST_BODY"""
+        return (MAX_REQUEST_BODY > 0
+                and 'Transfer-Encoding' not in self.headers
+                and self.headers.get('Content-Length', '0').isdigit()
+                and int(self.headers['Content-Length']) > MAX_REQUEST_BODY)
+    
+    def has_request_body(self):
+        return 'Transfer-Encoding' in self.headers or self.headers.get('Content-Length', '0') not in ('', '0')
+    
+    def request_body_framing(self):
+        """(content_length, gzipped) for the request body; content_length is None when chunked.
+
+        Raises RequestBodyError for codings we cannot decode and for a declared
+        length over MAX_REQUEST_BODY.
+        """
+        transfer_encoding = self.headers.get('Transfer-Encoding', '').strip().lower()
+        if transfer_encoding == 'chunked':
+            content_length = None
+        elif transfer_encoding:
+            raise RequestBodyError(501, f"Unsupported Transfer-Encoding: {transfer_encoding}")
+        else:
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+            except ValueError:
+                raise RequestBodyError(400, "Invalid Content-Length")
+            if MAX_REQUEST_BODY and content_length > MAX_REQUEST_BODY:
+                raise RequestBodyError(413, "Request body too large")
+        
+        content_encoding = self.headers.get('Content-Encoding', '').strip().lower()
+        if content_encoding not in ('', 'identity', 'gzip', 'x-gzip'):
+            raise RequestBodyError(415, f"Unsupported Content-Encoding: {content_encoding}")
+        return content_length, content_encoding in ('gzip', 'x-gzip')
+    
+    def iter_request_body(self):
+        """Yield the request body in pieces, de-chunked and gzip-inflated.
+
+        Raises RequestBodyError for framing or codings we cannot decode and once
+        the decoded body grows past MAX_REQUEST_BODY. Sets body_consumed when
+        the whole body has been read off the connection.
+        """
+        content_length, gzipped = self.request_body_framing()
+        if content_length is None:
+            raw = self.read_chunked_body()
+        else:
+            raw = self.read_fixed_body(content_length)
+        decoded = self.inflate_body(raw) if gzipped else raw
+        
+        total = 0
+        for chunk in decoded:
+            total += len(chunk)
+            if MAX_REQUEST_BODY and total > MAX_REQUEST_BODY:
+                raise RequestBodyError(413, "Request body too large")
+            yield chunk
+        self.body_consumed = True
+    
+    def read_fixed_body(self, content_length):
+        remaining = content_length
+        while remaining > 0:
+            chunk = self.rfile.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise RequestBodyError(400, "Request body ended early")
+            remaining -= len(chunk)
+            self.bytes_received += len(chunk)
+            yield chunk
+    
+    def read_chunked_body(self):
+        """Yield the payload of a Transfer-Encoding: chunked body"""
+        while True:
+            line = self.rfile.readline(65537)
+            if not line.endswith(b'\n'):
+                raise RequestBodyError(400, "Malformed chunked body")
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise RequestBodyError(400, "Malformed chunked body")
+            if size == 0:
+                # Skip trailer fields up to the blank line that ends the body
+                while line not in (b'\r\n', b'\n'):
+                    line = self.rfile.readline(65537)
+                    if not line:
+                        raise RequestBodyError(400, "Malformed chunked body")
+                return
+            yield from self.read_fixed_body(size)
+            if self.rfile.readline(3) not in (b'\r\n', b'\n'):
+                raise RequestBodyError(400, "Malformed chunked body")
+    
+    def inflate_body(self, raw):
+        inflater = GzipBodyInflater()
+        for data in raw:
+            yield from inflater.feed(data)
+        tail = inflater.finish()
+        if tail:
+            yield tail
+    
+    def shares_upload_pack(self, path):
+        """Whether this request is an upload-pack POST that may share a backend run"""
+        return self.command == 'POST' and path.endswith('/git-upload-pack') and self.can_coalesce_upload_pack()
+    
+    def can_coalesce_upload_pack(self):
+        """Whether this upload-pack POST is small enough to buffer and share"""
+        if COALESCE_MAX_BODY <= 0 or 'Transfer-Encoding' in self.headers:
+            return False
+        try:
+            content_length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return False
+        return 0 < content_length <= COALESCE_MAX_BODY
+    
+    @traced
+    def serve_coalesced_upload_pack(self, repo_name, repo_path, cmd, env, limiter):
+        """Answer an upload-pack POST from a backend run shared with identical requests.
+
+        CI fan-out sends many byte-identical requests (same wants, no haves) at
+        once; only the first starts pack-objects, and the rest replay its output
+        from the spill buffer at their own pace.
+        """
+        chunks = self.iter_request_body()
+        buffered = []
+        size = 0
+        try:
+            for chunk in chunks:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size > COALESCE_MAX_BODY:
+                    # A small gzip body inflated past what is worth holding in memory
+                    self.serve_unshared_upload_pack(repo_name, cmd, env, limiter, itertools.chain(buffered, chunks))
+                    return
+        except RequestBodyError as e:
+            self.send_error(e.status, str(e))
+            return
+        body = b''.join(buffered)
+        # The body is decoded (and inflated) here, so requests that differ only
+        # in how they were compressed still share a run
+        env = dict(env, CONTENT_LENGTH=str(len(body)))
+        
+        key = (
+            repo_path,
+            env['QUERY_STRING'],
+            env['CONTENT_TYPE'],
+            env.get('HTTP_GIT_PROTOCOL', ''),
+            tuple(sorted((k, v) for k, v in env.items() if k.startswith('GIT_CONFIG_'))),
+            hashlib.sha256(body).digest(),
+        )
+        
+        admission = getattr(self.server, 'admission', None)
+        
+        def run(flight):
+            # The pack budget is charged here, once per backend run, rather than
+            # by every request that joins it
+            if admission is not None and not admission.pack.acquire():
+                flight.busy = True
+                return
+            try:
+                if limiter is not None and not limiter.acquire(repo_name, REPO_SLOT_TIMEOUT):
+                    flight.busy = True
+                    return
+                try:
+                    run_shared_backend(flight, cmd, env, body)
+                finally:
+                    if limiter is not None:
+                        limiter.release(repo_name)
+            finally:
+                if admission is not None:
+                    admission.pack.release()
+        
+        flight = upload_pack_flights.join(key, run)
+        try:
+            if not self.relay_cgi_response(FanoutReader(flight.output)):
+                if flight.busy:
+                    self.send_busy(10)
+                else:
+                    error_msg = flight.stderr.decode('utf-8', errors='ignore')
+                    self.send_error(500, f"git-http-backend error: {error_msg}")
+        finally:
+            upload_pack_flights.leave(flight)
+    
+    def serve_unshared_upload_pack(self, repo_name, cmd, env, limiter, body):
+        """Stream an upload-pack that turned out too big to share, under the usual pack limits"""
+        admission = getattr(self.server, 'admission', None)
+        if admission is not None and not admission.pack.acquire():
+            self.send_busy(admission.pack.retry_after)
+            return
+        try:
+            if limiter is not None and not limiter.acquire(repo_name, REPO_SLOT_TIMEOUT):
+                self.send_busy(10)
+                return
+            try:
+                self.stream_git_http_backend(cmd, env, body)
+            finally:
+                if limiter is not None:
+                    limiter.release(repo_name)
+        finally:
+            if admission is not None:
+                admission.pack.release()
+    
+    @traced
+    def stream_git_http_backend(self, cmd, env, body=None):
+        """Run git-http-backend, streaming the request body in and the response out.
+
+        The request body (or body, decoded chunks of it already being read) is
+        copied into the backend's stdin by a feeder thread while this thread
+        parses the CGI headers as soon as they arrive and then relays the body
+        in STREAM_CHUNK_SIZE pieces, so memory stays flat regardless of pack size.
+        """
+        has_body = self.command == 'POST' and self.has_request_body()
+        if body is None:
+            if has_body:
+                # Refuse undecodable framing before the backend starts on an empty stdin
+                try:
+                    self.request_body_framing()
+                except RequestBodyError as e:
+                    self.send_error(e.status, str(e))
+                    return
+            body = self.iter_request_body()
+        
+        process = GitProcess(
+            cmd,
+            stdin=subprocess.PIPE if has_body else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=GIT_REPO_DIR
+        )
+        
+        stderr_tail = bytearray()
+        
+        def drain_stderr():
+            for chunk in iter(lambda: process.stderr.read1(STREAM_CHUNK_SIZE), b''):
+                stderr_tail.extend(chunk)
+                del stderr_tail[:-STDERR_TAIL_SIZE]
+        
+        body_errors = []
+        
+        def feed_stdin():
+            try:
+                for chunk in body:
+                    process.stdin.write(chunk)
+            except RequestBodyError as e:
+                # Stop the backend rather than hand it a truncated pack
+                body_errors.append(e)
+                process.kill()
+            except (BrokenPipeError, ConnectionError, ValueError):
+                # Backend exited early or the client went away; stdout tells the rest
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+        
+        helpers = [threading.Thread(target=drain_stderr, daemon=True)]
+        if has_body:
+            helpers.append(threading.Thread(target=feed_stdin, daemon=True))
+        for helper in helpers:
+            helper.start()
+        
+        try:
+            if not self.relay_cgi_response(process.stdout):
+                process.wait()
+                helpers[0].join()
+                if body_errors:
+                    self.send_error(body_errors[0].status, str(body_errors[0]))
+                    return
+                error_msg = stderr_tail.decode('utf-8', errors='ignore')
+                self.send_error(500, f"git-http-backend error: {error_msg}")
+            elif body_errors:
+                # The response was already under way; do not reuse the connection
+                self.close_connection = True
+        finally:
+            if process.poll() is None:
+                # Client disconnected mid-stream or we bailed out; stop the backend
+                process.stdout.close()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            for helper in helpers:
+                helper.join(timeout=5)
+            if any(helper.is_alive() for helper in helpers):
+                self.close_connection = True
+            process.stdout.close()
+            process.stderr.close()
+    
+    @traced
     def handle_request(self):
         """Handle git HTTP requests"""
         parsed_path = urlparse(self.path)
@@ -582,108 +3734,80 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
             '/git-receive-pack' in path
         )
         
+        if METRICS and path == '/metrics' and self.command == 'GET':
+            self.serve_metrics()
+            return
+        
+        # Repository files dumb-HTTP clients fetch directly: /repo.git/HEAD, /repo.git/objects/...
+        dumb_match = re.fullmatch(r'/([^/]+\.git)/(.+)', path)
+        if dumb_match and self.command == 'GET':
+            for pattern, content_type, immutable in DUMB_HTTP_FILES:
+                if pattern.fullmatch(dumb_match.group(2)):
+                    repo_path = os.path.join(GIT_REPO_DIR, dumb_match.group(1))
+                    if not os.path.isdir(repo_path):
+                        self.send_error(404, "Repository not found")
+                        return
+                    cache_control = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+                    self.serve_static_file(repo_path, dumb_match.group(2), content_type, cache_control)
+                    return
+        
         if is_git_request:
             # Extract repository name and full path
-            repo_name = None
-            if '/info/refs' in path:
-                repo_name = path.split('/info/refs')[0].lstrip('/')
-            elif '/git-upload-pack' in path:
-                repo_name = path.split('/git-upload-pack')[0].lstrip('/')
-            elif '/git-receive-pack' in path:
-                repo_name = path.split('/git-receive-pack')[0].lstrip('/')
-            elif path.endswith('.git'):
-                repo_name = path.lstrip('/')
+            repo_name = git_repo_name(path)
             
             if repo_name:
                 repo_path = os.path.join(GIT_REPO_DIR, repo_name)
                 if os.path.exists(repo_path) and os.path.isdir(repo_path):
-                    # Set environment variables for git-http-backend
-                    env = os.environ.copy()
-                    env['GIT_PROJECT_ROOT'] = GIT_REPO_DIR
-                    env['GIT_HTTP_EXPORT_ALL'] = '1'
-                    env['REQUEST_METHOD'] = self.command
-                    env['PATH_INFO'] = '/' + path.lstrip('/')
-                    env['QUERY_STRING'] = parsed_path.query
-                    env['CONTENT_TYPE'] = self.headers.get('Content-Type', '')
-                    env['CONTENT_LENGTH'] = self.headers.get('Content-Length', '0')
-                    env['HTTP_USER_AGENT'] = self.headers.get('User-Agent', '')
+                    repo_maintenance.touch(repo_name)
+                    env = self.git_backend_env(path, parsed_path.query, repo_name)
+                    
+                    # Refuse oversized bodies before git-http-backend starts its response
+                    if self.command == 'POST' and self.declared_body_too_large():
+                        self.send_error(413, "Request body too large")
+                        return
                     
                     # Prepare git-http-backend command
                     cmd = [GIT_HTTP_BACKEND]
                     
+                    # Ref advertisements for v0/v1 clients (Jenkins polling) come from cache
+                    if self.command == 'GET' and path.endswith('/info/refs'):
+                        service = parse_qs(parsed_path.query).get('service', [''])[0]
+                        if (service in ('git-upload-pack', 'git-receive-pack')
+                                and 'version=2' not in env.get('HTTP_GIT_PROTOCOL', '')):
+                            try:
+                                if self.serve_cached_advertisement(repo_path, service, cmd, env):
+                                    return
+                            except Exception as e:
+                                self.send_error(500, f"Error executing git-http-backend: {str(e)}")
+                                return
+                    
+                    # Pack generation is the expensive part; cap it per repository
+                    is_pack_request = self.command == 'POST' and (
+                        path.endswith('/git-upload-pack') or path.endswith('/git-receive-pack')
+                    )
+                    limiter = getattr(self.server, 'repo_limiter', None)
+                    if (is_pack_request and path.endswith('/git-upload-pack')
+                            and self.can_coalesce_upload_pack()):
+                        try:
+                            self.serve_coalesced_upload_pack(repo_name, repo_path, cmd, env, limiter)
+                        except Exception as e:
+                            self.send_error(500, f"Error executing git-http-backend: {str(e)}")
+                        return
+                    if is_pack_request and limiter is not None:
+                        if not limiter.acquire(repo_name, REPO_SLOT_TIMEOUT):
+                            self.send_busy(10)
+                            return
+                    
                     # Execute git-http-backend
                     try:
-                        process = subprocess.Popen(
-                            cmd,
-                            stdin=subprocess.PIPE,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            env=env,
-                            cwd=GIT_REPO_DIR
-                        )
-                        
-                        # Send request body if present
-                        if self.command == 'POST':
-                            content_length = int(self.headers.get('Content-Length', 0))
-                            if content_length > 0:
-                                body = self.rfile.read(content_length)
-                                stdout, stderr = process.communicate(input=body)
-                            else:
-                                stdout, stderr = process.communicate()
-                        else:
-                            stdout, stderr = process.communicate()
-                        
-                        # Check for errors
-                        if process.returncode != 0:
-                            error_msg = stderr.decode('utf-8', errors='ignore')
-                            self.send_error(500, f"git-http-backend error: {error_msg}")
-                            return
-                        
-                        # Parse response (git-http-backend outputs headers followed by body)
-                        response_data = stdout
-                        header_end = response_data.find(b'\r\n\r\n')
-                        if header_end == -1:
-                            header_end = response_data.find(b'\n\n')
-                        
-                        if header_end != -1:
-                            header_data = response_data[:header_end]
-                            body_data = response_data[header_end + 2:]
-                            
-                            # Parse headers
-                            status_code = 200
-                            headers = {}
-                            for line in header_data.decode('utf-8', errors='ignore').split('\n'):
-                                line = line.strip()
-                                if not line:
-                                    continue
-                                if ':' in line:
-                                    key, value = line.split(':', 1)
-                                    key = key.strip().lower()
-                                    value = value.strip()
-                                    if key == 'status':
-                                        try:
-                                            status_code = int(value.split()[0])
-                                        except:
-                                            pass
-                                    else:
-                                        headers[key] = value
-                            
-                            # Send response
-                            self.send_response(status_code)
-                            for key, value in headers.items():
-                                self.send_header(key, value)
-                            self.end_headers()
-                            
-                            # Send body (may be binary)
-                            self.wfile.write(body_data)
-                        else:
-                            # No headers, send raw response
-                            self.send_response(200)
-                            self.end_headers()
-                            self.wfile.write(response_data)
-                        
+                        self.stream_git_http_backend(cmd, env)
                     except Exception as e:
                         self.send_error(500, f"Error executing git-http-backend: {str(e)}")
+                    finally:
+                        if is_pack_request and path.endswith('/git-receive-pack'):
+                            after_receive_pack(repo_name, repo_path)
+                        if is_pack_request and limiter is not None:
+                            limiter.release(repo_name)
                 else:
                     self.send_error(404, "Repository not found")
             else:
@@ -702,17 +3826,55 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
                 repo_full_name = repo_name + '.git'
                 repo_path = os.path.join(GIT_REPO_DIR, repo_full_name)
                 
+                offset = 0
+                if view_type == 'blob':
+                    try:
+                        offset = int(parse_qs(parsed_path.query).get('offset', ['0'])[0])
+                    except ValueError:
+                        offset = 0
+                
                 if os.path.exists(repo_path) and os.path.isdir(repo_path):
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html; charset=utf-8')
-                    self.end_headers()
+                    encoding = self.negotiate_encoding()
+                    etag = self.browser_page_etag(view_type, repo_name, repo_path, branch, file_path, str(offset))
+                    if etag is not None and self.etag_matches(encoded_etag(etag, encoding)):
+                        self.send_response(304)
+                        self.send_header('ETag', encoded_etag(etag, encoding))
+                        self.send_header('Cache-Control', 'no-cache')
+                        self.send_header('Vary', 'Accept-Encoding')
+                        self.end_headers()
+                        return
+                    
+                    if etag is not None:
+                        # Cached pages are stored per content-coding; compress an
+                        # identity copy once if this coding has not been asked for yet
+                        variant = encoding or 'identity'
+                        page = page_cache.get((etag, variant))
+                        if page is None and encoding is not None:
+                            identity = page_cache.get((etag, 'identity'))
+                            if identity is not None:
+                                page = compress_bytes(identity, encoding)
+                                page_cache.put((etag, variant), page, len(page))
+                        if page is not None:
+                            self.send_cached_page(page, etag, encoding)
+                            return
                     
                     if view_type == 'blob':
-                        html_content = self.render_file_view(repo_name, repo_path, branch, file_path)
+                        chunks = self.render_file_view(repo_name, repo_path, branch, file_path, offset)
                     else:  # tree
-                        html_content = self.render_repo_browser(repo_name, repo_path, branch, file_path)
-                    
-                    self.wfile.write(html_content.encode('utf-8'))
+                        chunks = self.render_repo_browser(repo_name, repo_path, branch, file_path)
+                    variants = self.send_page(chunks, etag, encoding)
+                    if etag is not None and variants is not None:
+                        for variant, page in variants.items():
+                            page_cache.put((etag, variant), page, len(page))
+                else:
+                    self.send_error(404, "Repository not found")
+            
+            # Raw file bytes: /repo-name/raw/ref/path
+            elif len(path_parts) >= 4 and path_parts[1] == 'raw':
+                repo_name = path_parts[0]
+                repo_path = os.path.join(GIT_REPO_DIR, repo_name + '.git')
+                if os.path.exists(repo_path) and os.path.isdir(repo_path):
+                    self.serve_raw_blob(repo_path, path_parts[2], '/'.join(path_parts[3:]))
                 else:
                     self.send_error(404, "Repository not found")
             
@@ -727,174 +3889,24 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
                     default_branch = self.get_default_branch(repo_path)
                     self.send_response(302)
                     self.send_header('Location', f'/{repo_name}/tree/{default_branch}')
+                    self.send_header('Content-Length', '0')
                     self.end_headers()
                 else:
                     # Serve repository list
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html; charset=utf-8')
-                    self.end_headers()
-                    
-                    html = """<!DOCTYPE html>
-<html>
-<head>
-    <title>Git Repositories</title>
-    <style>
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Helvetica, Arial, sans-serif;
-            margin: 0;
-            padding: 40px 20px;
-            background: #f6f8fa;
-            color: #24292e;
-        }
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 6px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.12);
-            padding: 30px;
-        }
-        h1 {
-            margin: 0 0 30px 0;
-            font-size: 32px;
-            border-bottom: 1px solid #eaecef;
-            padding-bottom: 15px;
-        }
-        ul {
-            list-style: none;
-            padding: 0;
-            margin: 0;
-        }
-        li {
-            padding: 12px 0;
-            border-bottom: 1px solid #eaecef;
-        }
-        li:last-child {
-            border-bottom: none;
-        }
-        a {
-            color: #0366d6;
-            text-decoration: none;
-            font-size: 16px;
-        }
-        a:hover {
-            text-decoration: underline;
-        }
-        .repo-actions {
-            margin-left: 15px;
-            font-size: 12px;
-            color: #586069;
-        }
-        .repo-actions a {
-            font-size: 12px;
-            margin-left: 10px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Available Git Repositories</h1>
-        <ul>
-"""
-                    if os.path.exists(GIT_REPO_DIR):
-                        repos = [d for d in os.listdir(GIT_REPO_DIR) 
-                                if os.path.isdir(os.path.join(GIT_REPO_DIR, d)) and d.endswith('.git')]
-                        for repo in sorted(repos):
-                            repo_name = repo.replace('.git', '')
-                            html += f'<li><a href="/{repo_name}">{repo_name}</a>'
-                            html += f'<span class="repo-actions">'
-                            html += f'<a href="/{repo_name}.git">[Clone]</a>'
-                            html += f'</span></li>\n'
-                    
-                    html += """        </ul>
-    </div>
-</body>
-</html>"""
-                    self.wfile.write(html.encode('utf-8'))
+                    self.send_page(self.render_repo_list(), encoding=self.negotiate_encoding())
             
             # Root path - serve repository list
             elif len(path_parts) == 0:
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html; charset=utf-8')
-                self.end_headers()
-                
-                html = """<!DOCTYPE html>
-<html>
-<head>
-    <title>Git Repositories</title>
-    <style>
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Helvetica, Arial, sans-serif;
-            margin: 0;
-            padding: 40px 20px;
-            background: #f6f8fa;
-            color: #24292e;
-        }
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 6px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.12);
-            padding: 30px;
-        }
-        h1 {
-            margin: 0 0 30px 0;
-            font-size: 32px;
-            border-bottom: 1px solid #eaecef;
-            padding-bottom: 15px;
-        }
-        ul {
-            list-style: none;
-            padding: 0;
-            margin: 0;
-        }
-        li {
-            padding: 12px 0;
-            border-bottom: 1px solid #eaecef;
-        }
-        li:last-child {
-            border-bottom: none;
-        }
-        a {
-            color: #0366d6;
-            text-decoration: none;
-            font-size: 16px;
-        }
-        a:hover {
-            text-decoration: underline;
-        }
-        .repo-actions {
-            margin-left: 15px;
-            font-size: 12px;
-            color: #586069;
-        }
-        .repo-actions a {
-            font-size: 12px;
-            margin-left: 10px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Available Git Repositories</h1>
-        <ul>
-"""
-                if os.path.exists(GIT_REPO_DIR):
-                    repos = [d for d in os.listdir(GIT_REPO_DIR) 
-                            if os.path.isdir(os.path.join(GIT_REPO_DIR, d)) and d.endswith('.git')]
-                    for repo in sorted(repos):
-                        repo_name = repo.replace('.git', '')
-                        html += f'<li><a href="/{repo_name}">{repo_name}</a>'
-                        html += f'<span class="repo-actions">'
-                        html += f'<a href="/{repo_name}.git">[Clone]</a>'
-                        html += f'</span></li>\n'
-                
-                html += """        </ul>
-    </div>
-</body>
-</html>"""
-                self.wfile.write(html.encode('utf-8'))
+                self.send_page(self.render_repo_list(), encoding=self.negotiate_encoding())
+            
+            # Precomputed clone bundle: /repo-name.git/clone.bundle
+            elif len(path_parts) == 2 and path_parts[0].endswith('.git') and path_parts[1] == 'clone.bundle':
+                self.serve_static_file(server_cache_dir('bundles'), path_parts[0] + '.bundle',
+                                       'application/x-git-bundle', 'no-cache')
+            
+            # Shared stylesheet, versioned by content
+            elif len(path_parts) == 2 and path_parts[0] == 'static' and path_parts[1] == STYLESHEET_NAME:
+                self.serve_stylesheet()
             else:
                 self.send_error(404, "Not found")
     
@@ -905,8 +3917,635 @@ class GitHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
                          self.log_date_time_string(),
                          format % args))
 
-def main():
+class AsyncResponseWriter:
+    """wfile for a GitHTTPRequestHandler driven by the asyncio engine.
+
+    On the event loop, writes are buffered and go out on the next drain();
+    from a worker thread (bridged routes) each write is handed to the loop
+    and waits for the transport to drain, so pages and files keep their
+    backpressure too.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.threaded = False
+        self.bytes_written = 0
+        self._buffer = []
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        if self.threaded:
+            asyncio.run_coroutine_threadsafe(self._send(bytes(data)), self.loop).result()
+        else:
+            self._buffer.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    async def drain(self):
+        if self._buffer:
+            self.writer.write(b''.join(self._buffer))
+            self._buffer = []
+        await asyncio.wait_for(self.writer.drain(), REQUEST_TIMEOUT)
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), REQUEST_TIMEOUT)
+
+
+class AsyncConnection:
+    """Stands in for the client socket of a handler driven by the asyncio engine"""
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def settimeout(self, timeout):
+        pass    # the engine applies its own timeouts
+
+    def sendfile(self, file, offset, count):
+        """Zero-copy send from a worker thread through the loop's transport"""
+        return asyncio.run_coroutine_threadsafe(
+            self.loop.sendfile(self.writer.transport, file, offset, count), self.loop
+        ).result()
+
+
+class AsyncBridgeHandler(GitHTTPRequestHandler):
+    """GitHTTPRequestHandler driven by the asyncio engine instead of its own socket.
+
+    The engine parses each request through it and borrows its helpers for the
+    routes it proxies itself; every other route runs the usual handler code
+    in a worker thread.
+    """
+
+    def __init__(self, server, client_address, loop, writer, requests_handled):
+        # BaseRequestHandler.__init__ would serve the connection; set up by hand
+        self.server = server
+        self.client_address = client_address
+        self.request = self.connection = AsyncConnection(loop, writer)
+        self.rfile = io.BytesIO()
+        self.wfile = AsyncResponseWriter(loop, writer)
+        self.requests_handled = requests_handled
+        self.connection_header_sent = False
+        self.close_connection = True
+        self.body_consumed = True
+        self.request_started = None
+        self.trace = None
+
+    def handle_admitted_request(self):
+        # The engine has already admitted this request
+        self.handle_request()
+
+    def parse_head(self, head):
+        """Parse a request line and header block read by the engine"""
+        self.rfile = io.BytesIO(head)
+        self.raw_requestline = self.rfile.readline(65537)
+        self.rfile = io.BytesIO(self.rfile.read())
+        self.command = None
+        return self.parse_request()
+
+
+class AsyncGitServer:
+    """asyncio serving engine: one event loop instead of a thread per connection.
+
+    Idle keep-alive and slow connections cost a coroutine each. Pack requests
+    and protocol v2 advertisements are proxied to git-http-backend over
+    asyncio subprocess pipes, reading more from the backend only once the
+    client has drained what was sent. The remaining routes (browser pages,
+    files, cached advertisements, coalesced upload-packs) run the threaded
+    handler's code on a pool of max_workers threads; at most max_queue of
+    them wait for a thread, and the rest get an immediate 503.
+    """
+
+    BRIDGED_BODY_LIMIT = 64 * 1024  # request bodies read up front for bridged routes
+
+    def __init__(self, server_address, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE_DEPTH,
+                 pack_limit=MAX_PACK_PER_REPO, reuse_port=False, admission=None):
+        self.server_address = server_address
+        self.reuse_port = reuse_port
+        self.repo_limiter = RepoConcurrencyLimiter(pack_limit)
+        self.admission = admission
+        # Requests that have to queue for admission wait here, off the event loop, with a
+        # thread for every wait the budgets allow
+        waiters = sum(budget.max_waiting for _, budget in admission.budgets()) if admission is not None else 0
+        self._admission_waiters = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(waiters, 1), thread_name_prefix='git-http-admission'
+        )
+        self.draining = False
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(max_workers, 1), thread_name_prefix='git-http-bridge'
+        )
+        self._bridge_capacity = max(max_workers, 1) + max(max_queue, 0)
+        self._bridged = 0       # bridged requests running or waiting for a thread
+        self.loop = None
+        self._connections = set()
+        self._idle = set()      # connections waiting for their next request
+
+    def serve_forever(self):
+        """Serve until SIGTERM/SIGINT, then let in-flight requests finish"""
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self._connection, host or None, port,
+            reuse_address=True, reuse_port=self.reuse_port or None, backlog=1024,
+        )
+        stopped = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(signum, stopped.set)
+        await stopped.wait()
+        
+        self.draining = True
+        server.close()
+        for writer in list(self._idle):
+            writer.close()
+        deadline = time.monotonic() + SHUTDOWN_GRACE
+        while self._connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.executor.shutdown(wait=False)
+        self._admission_waiters.shutdown(wait=False)
+
+    async def _connection(self, reader, writer):
+        self._connections.add(writer)
+        client_address = writer.get_extra_info('peername') or ('', 0)
+        requests_handled = 0
+        try:
+            while not self.draining:
+                self._idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'),
+                        KEEPALIVE_TIMEOUT if requests_handled else REQUEST_TIMEOUT,
+                    )
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                finally:
+                    self._idle.discard(writer)
+                
+                handler = AsyncBridgeHandler(self, client_address, self.loop, writer, requests_handled)
+                try:
+                    parsed = handler.parse_head(head)
+                    requests_handled = handler.requests_handled
+                    await handler.wfile.drain()
+                    if not parsed:
+                        break
+                    await self._dispatch(handler, reader)
+                except (ConnectionError, asyncio.TimeoutError):
+                    break
+                except Exception:
+                    sys.stderr.write(f"Error handling {handler.requestline!r} from {client_address[0]}\n")
+                    traceback.print_exc()
+                    break
+                finally:
+                    handler.request_finished()
+                if handler.close_connection or not handler.body_consumed:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, handler, reader):
+        handler.body_consumed = not handler.has_request_body()
+        parsed_path = urlparse(handler.path)
+        path = unquote(parsed_path.path)
+        
+        repo_name = git_repo_name(path)
+        proxied = False
+        if repo_name and os.path.isdir(os.path.join(GIT_REPO_DIR, repo_name)):
+            if handler.command == 'POST' and path.endswith(('/git-upload-pack', '/git-receive-pack')):
+                proxied = not (path.endswith('/git-upload-pack') and handler.can_coalesce_upload_pack())
+            elif handler.command == 'GET' and path.endswith('/info/refs'):
+                # v0 advertisements are served from the ref cache by the bridged handler
+                service = parse_qs(parsed_path.query).get('service', [''])[0]
+                proxied = (service in ('git-upload-pack', 'git-receive-pack')
+                           and 'version=2' in handler.headers.get('Git-Protocol', ''))
+        
+        budget = None
+        if self.admission is not None:
+            shared = not proxied and handler.shares_upload_pack(path)
+            budget = self.admission.budget_for(handler.command, path, shared=shared)
+            # The wait is reserved here, on the loop, so the waiter pool never has more
+            # waits queued than it has threads
+            if budget is not None and not budget.acquire(wait=False) and (
+                    not budget.reserve_wait() or not await self.loop.run_in_executor(
+                        self._admission_waiters, functools.partial(budget.acquire, reserved=True))):
+                handler.send_busy(budget.retry_after)
+                await handler.wfile.drain()
+                return
+        try:
+            if proxied:
+                await self._proxy_git_backend(handler, reader, path, parsed_path.query, repo_name)
+            else:
+                await self._bridge(handler, reader)
+        finally:
+            if budget is not None:
+                budget.release()
+
+    async def _bridge(self, handler, reader):
+        """Run the threaded handler's code for this request on the worker pool"""
+        if self._bridged >= self._bridge_capacity:
+            handler.send_busy(5)
+            await handler.wfile.drain()
+            return
+        self._bridged += 1
+        try:
+            await self._run_bridged(handler, reader)
+        finally:
+            self._bridged -= 1
+
+    async def _run_bridged(self, handler, reader):
+        preread = False
+        if handler.has_request_body():
+            length = handler.headers.get('Content-Length', '')
+            if ('Transfer-Encoding' not in handler.headers and length.isdigit()
+                    and int(length) <= self.BRIDGED_BODY_LIMIT):
+                body = await asyncio.wait_for(reader.readexactly(int(length)), REQUEST_TIMEOUT)
+                handler.rfile = io.BytesIO(body)
+                preread = True
+        
+        handler.wfile.threaded = True
+        method = getattr(handler, 'do_' + handler.command, None)
+        
+        def run():
+            if method is None:
+                handler.send_error(501, f"Unsupported method ({handler.command!r})")
+            else:
+                method()
+        
+        await self.loop.run_in_executor(self.executor, run)
+        if preread:
+            handler.body_consumed = True
+
+    async def _proxy_git_backend(self, handler, reader, path, query, repo_name):
+        """Async counterpart of the smart-HTTP branch of handle_request"""
+        repo_path = os.path.join(GIT_REPO_DIR, repo_name)
+        repo_maintenance.touch(repo_name)
+        try:
+            content_length, gzipped = handler.request_body_framing()
+        except RequestBodyError as e:
+            handler.send_error(e.status, str(e))
+            await handler.wfile.drain()
+            return
+        
+        env = handler.git_backend_env(path, query, repo_name)
+        is_pack_request = handler.command == 'POST'
+        if is_pack_request and not await self.loop.run_in_executor(
+                None, self.repo_limiter.acquire, repo_name, REPO_SLOT_TIMEOUT):
+            handler.send_busy(10)
+            await handler.wfile.drain()
+            return
+        started = handler.trace.enter('git-http-backend') if handler.trace is not None else None
+        try:
+            await self._run_backend(handler, reader, env, content_length, gzipped)
+        finally:
+            if handler.trace is not None:
+                handler.trace.exit(started)
+            if path.endswith('/git-receive-pack'):
+                after_receive_pack(repo_name, repo_path)
+            if is_pack_request:
+                self.repo_limiter.release(repo_name)
+
+    async def _run_backend(self, handler, reader, env, content_length, gzipped):
+        has_body = handler.command == 'POST' and handler.has_request_body()
+        process = await asyncio.create_subprocess_exec(
+            GIT_HTTP_BACKEND,
+            stdin=asyncio.subprocess.PIPE if has_body else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            cwd=GIT_REPO_DIR,
+        )
+        started = time.monotonic()
+        command_name = git_command_name([GIT_HTTP_BACKEND])
+        metrics.inc('git_processes_started_total', command=command_name)
+        stderr_tail = bytearray()
+        body_errors = []
+        
+        async def drain_stderr():
+            while True:
+                chunk = await process.stderr.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                stderr_tail.extend(chunk)
+                del stderr_tail[:-STDERR_TAIL_SIZE]
+        
+        async def feed_stdin():
+            try:
+                async for chunk in self._request_body(handler, reader, content_length, gzipped):
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except RequestBodyError as e:
+                # Stop the backend rather than hand it a truncated pack
+                body_errors.append(e)
+                process.kill()
+            except (ConnectionError, asyncio.TimeoutError):
+                # Backend exited early or the client went away; stdout tells the rest
+                pass
+            finally:
+                process.stdin.close()
+        
+        helpers = [asyncio.ensure_future(drain_stderr())]
+        if has_body:
+            helpers.append(asyncio.ensure_future(feed_stdin()))
+        
+        try:
+            # Parse CGI response headers (terminated by an empty line)
+            header_lines = []
+            headers_complete = False
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', errors='ignore').strip()
+                if not line:
+                    headers_complete = True
+                    break
+                header_lines.append(line)
+            
+            if not headers_complete:
+                await process.wait()
+                await helpers[0]
+                if body_errors:
+                    handler.send_error(body_errors[0].status, str(body_errors[0]))
+                else:
+                    error_msg = stderr_tail.decode('utf-8', errors='ignore')
+                    handler.send_error(500, f"git-http-backend error: {error_msg}")
+                await handler.wfile.drain()
+                return
+            
+            # Read more from the backend only once the client has taken the last piece
+            out = handler.start_cgi_response(header_lines)
+            await handler.wfile.drain()
+            while True:
+                chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                out.flush()
+                await handler.wfile.drain()
+            out.close()
+            await handler.wfile.drain()
+            if body_errors:
+                handler.close_connection = True
+        finally:
+            if process.returncode is None:
+                # Client disconnected mid-stream or we bailed out; stop the backend
+                try:
+                    await asyncio.wait_for(process.wait(), 5 if process.stdout.at_eof() else 0)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+            metrics.observe('git_process_duration_seconds', time.monotonic() - started, command=command_name)
+            for helper in helpers:
+                if not helper.done():
+                    helper.cancel()
+            await asyncio.gather(*helpers, return_exceptions=True)
+
+    async def _request_body(self, handler, reader, content_length, gzipped):
+        """Async counterpart of GitHTTPRequestHandler.iter_request_body"""
+        if content_length is None:
+            raw = self._read_chunked_body(reader)
+        else:
+            raw = self._read_fixed_body(reader, content_length)
+        inflater = GzipBodyInflater() if gzipped else None
+        total = 0
+        async for data in raw:
+            handler.bytes_received += len(data)
+            for chunk in (inflater.feed(data) if inflater else (data,)):
+                total += len(chunk)
+                if MAX_REQUEST_BODY and total > MAX_REQUEST_BODY:
+                    raise RequestBodyError(413, "Request body too large")
+                yield chunk
+        if inflater is not None:
+            tail = inflater.finish()
+            total += len(tail)
+            if MAX_REQUEST_BODY and total > MAX_REQUEST_BODY:
+                raise RequestBodyError(413, "Request body too large")
+            if tail:
+                yield tail
+        handler.body_consumed = True
+
+    async def _read_fixed_body(self, reader, remaining):
+        while remaining > 0:
+            chunk = await asyncio.wait_for(reader.read(min(STREAM_CHUNK_SIZE, remaining)), REQUEST_TIMEOUT)
+            if not chunk:
+                raise RequestBodyError(400, "Request body ended early")
+            remaining -= len(chunk)
+            yield chunk
+
+    async def _read_chunked_body(self, reader):
+        async def readline():
+            try:
+                return await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            except ValueError:
+                raise RequestBodyError(400, "Malformed chunked body")
+        
+        while True:
+            line = await readline()
+            if not line.endswith(b'\n'):
+                raise RequestBodyError(400, "Malformed chunked body")
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise RequestBodyError(400, "Malformed chunked body")
+            if size == 0:
+                # Skip trailer fields up to the blank line that ends the body
+                while line not in (b'\r\n', b'\n'):
+                    line = await readline()
+                    if not line:
+                        raise RequestBodyError(400, "Malformed chunked body")
+                return
+            async for chunk in self._read_fixed_body(reader, size):
+                yield chunk
+            if await readline() not in (b'\r\n', b'\n'):
+                raise RequestBodyError(400, "Malformed chunked body")
+
+
+class PreforkSupervisor:
+    """Keeps N forked server processes running on one SO_REUSEPORT port.
+
+    Each worker binds its own listening socket, so the kernel spreads new
+    connections across processes and the GIL is no longer a ceiling. A worker
+    that dies is replaced, after a growing delay if it keeps dying young;
+    SIGTERM or SIGINT is passed on to every worker and the supervisor exits
+    once they have drained.
+    """
+
+    def __init__(self, processes, serve):
+        self.processes = processes
+        self.serve = serve      # called with the worker's slot, 0..processes-1
+        self._children = {}     # pid -> (slot, start time)
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.processes):
+            self._spawn(slot)
+        delay = WORKER_RESTART_DELAY
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            child = self._children.pop(pid, None)
+            shared_metrics.retire(pid)
+            if child is None or self._stopping:
+                continue
+            slot, started = child
+            sys.stderr.write(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting\n")
+            if time.monotonic() - started < 10:
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+            else:
+                delay = WORKER_RESTART_DELAY
+            if not self._stopping:
+                self._spawn(slot)
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            # The supervisor's handlers would signal our siblings; serve() installs its own
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._children = {}
+            code = 1
+            try:
+                self.serve(slot)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self._children[pid] = (slot, time.monotonic())
+
+    def _stop(self, signum, frame):
+        if self._stopping:
+            return
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve git repositories over HTTP via git-http-backend')
+    parser.add_argument('--repo-dir', default=GIT_REPO_DIR,
+                        help='directory holding the bare <name>.git repositories')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='on-disk indexes and bundles (default: <repo-dir>/.git-server-cache)')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads',
+                        help='threads: a worker thread per connection; asyncio: one event loop, '
+                             'with threads only for browser pages and files')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='server processes sharing the port via SO_REUSEPORT; 1 serves from this process')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS,
+                        help='worker threads serving connections (per process); 0 handles one request at a time')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE_DEPTH,
+                        help='connections (with --engine asyncio: bridged requests) allowed to wait '
+                             'for a worker before answering 503')
+    parser.add_argument('--repo-pack-limit', type=int, default=MAX_PACK_PER_REPO,
+                        help='concurrent upload-pack/receive-pack runs per repository (per process); 0 for no limit')
+    parser.add_argument('--max-pack-runs', type=int, default=PACK_CONCURRENCY,
+                        help='clones/fetches/pushes admitted at once across all repositories (per process); 0 for no limit')
+    parser.add_argument('--max-pack-queue', type=int, default=PACK_QUEUE_DEPTH,
+                        help='pack requests allowed to wait for admission before answering 503')
+    parser.add_argument('--pack-queue-timeout', type=float, default=PACK_QUEUE_TIMEOUT,
+                        help='seconds a pack request may wait for admission before answering 503')
+    parser.add_argument('--max-body-size', type=int, default=MAX_REQUEST_BODY,
+                        help='largest decoded request body in bytes (pushes included); 0 for no limit')
+    parser.add_argument('--slow-request', type=float, default=SLOW_REQUEST_SECONDS, metavar='SECONDS',
+                        help='log requests slower than this with their timing spans (0 = off)')
+    parser.add_argument('--slow-log', default=SLOW_LOG, metavar='PATH',
+                        help='file for the slow request log (default: stderr)')
+    parser.add_argument('--profile-sample', type=float, default=PROFILE_SAMPLE_RATE, metavar='RATE',
+                        help='fraction of requests to run under cProfile (0 = off)')
+    parser.add_argument('--profile-dir', default=PROFILE_DIR, metavar='DIR',
+                        help=f'where sampled profiles go; the newest {PROFILE_KEEP} are kept')
+    parser.add_argument('--no-metrics', dest='metrics', action='store_false', default=METRICS,
+                        help='do not serve Prometheus metrics at /metrics')
+    parser.add_argument('--no-maintenance', dest='maintenance', action='store_false', default=MAINTENANCE,
+                        help='do not repack or write commit-graphs/bitmaps in the background')
+    parser.add_argument('--no-bundle-uri', dest='bundle_uri', action='store_false', default=BUNDLE_URIS,
+                        help='do not build or advertise clone bundles')
+    return parser.parse_args(argv)
+
+def serve(args, reuse_port=False, worker=None):
+    """Run one server process until SIGTERM/SIGINT, then let in-flight requests finish.
+
+    worker is the slot of a --workers process; slot 0 runs maintenance for all of them.
+    """
+    admission = AdmissionControl(args.max_pack_runs, args.max_pack_queue, args.pack_queue_timeout)
+    if args.maintenance and worker is None:
+        repo_maintenance.start(busy=lambda: admission.pack.active > 0)
+    elif args.maintenance and worker == 0:
+        repo_maintenance.start(busy=lambda: admission.pack.active > 0 or shared_metrics.others_pack_active() > 0,
+                               follow=shared_metrics.maintenance_states)
+    shared_metrics.start(lambda: metrics.collect(metric_samples(admission)))
+    if args.engine == 'asyncio':
+        httpd = AsyncGitServer(
+            ('', SERVER_PORT),
+            max_workers=args.max_workers,
+            max_queue=args.max_queue,
+            pack_limit=args.repo_pack_limit,
+            reuse_port=reuse_port,
+            admission=admission,
+        )
+        if BUNDLE_URIS:
+            clone_bundles.start()
+        try:
+            httpd.serve_forever()
+        finally:
+            catfile_pool.close()
+            shared_metrics.publish(metrics.collect(metric_samples(admission)))
+        return
+    
+    httpd = BoundedThreadPoolHTTPServer(
+        ('', SERVER_PORT),
+        GitHTTPRequestHandler,
+        max_workers=args.max_workers,
+        max_queue=args.max_queue,
+        pack_limit=args.repo_pack_limit,
+        reuse_port=reuse_port,
+        admission=admission,
+    )
+    if BUNDLE_URIS:
+        clone_bundles.start()
+    
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which is running in this thread
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.drain(SHUTDOWN_GRACE)
+        httpd.server_close()
+        catfile_pool.close()
+        shared_metrics.publish(metrics.collect(metric_samples(admission)))
+
+def main(argv=None):
     """Start the git HTTP server"""
+    args = parse_args(argv)
+    
+    global GIT_REPO_DIR, SERVER_PORT, CACHE_DIR
+    GIT_REPO_DIR = args.repo_dir
+    SERVER_PORT = args.port
+    CACHE_DIR = args.cache_dir
+    
     if not os.path.exists(GIT_REPO_DIR):
         print(f"Error: Git repository directory not found: {GIT_REPO_DIR}")
         sys.exit(1)
@@ -915,19 +4554,47 @@ def main():
         print(f"Error: git-http-backend not found: {GIT_HTTP_BACKEND}")
         sys.exit(1)
     
-    server_address = ('', SERVER_PORT)
-    httpd = http.server.HTTPServer(server_address, GitHTTPRequestHandler)
+    global BUNDLE_URIS, MAX_REQUEST_BODY, METRICS
+    global SLOW_REQUEST_SECONDS, SLOW_LOG, PROFILE_SAMPLE_RATE, PROFILE_DIR
+    BUNDLE_URIS = args.bundle_uri
+    MAX_REQUEST_BODY = args.max_body_size
+    METRICS = args.metrics
+    SLOW_REQUEST_SECONDS = args.slow_request
+    SLOW_LOG = args.slow_log
+    PROFILE_SAMPLE_RATE = args.profile_sample
+    PROFILE_DIR = args.profile_dir
+    
+    if args.workers > 1:
+        # Fail here rather than have every worker crash-loop on a taken port
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            probe.bind(('', SERVER_PORT))
+        except OSError as e:
+            print(f"Error: cannot listen on port {SERVER_PORT}: {e}")
+            sys.exit(1)
+        finally:
+            probe.close()
     
     print(f"Git HTTP Server starting on port {SERVER_PORT}")
+    print(f"Engine: {args.engine}, processes: {max(args.workers, 1)}, workers: {args.max_workers}, queue depth: {args.max_queue}, "
+          f"pack runs per repository: {args.repo_pack_limit or 'unlimited'}")
     print(f"Serving repositories from: {GIT_REPO_DIR}")
     print(f"Access repositories at: http://localhost:{SERVER_PORT}/<repo-name>.git")
     print("Press Ctrl+C to stop the server")
+    sys.stdout.flush()
     
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nShutting down server...")
-        httpd.shutdown()
+    if args.workers > 1:
+        if METRICS or args.maintenance:
+            shared_metrics.enable(tempfile.mkdtemp(prefix='git-server-metrics-'))
+        try:
+            PreforkSupervisor(args.workers, lambda slot: serve(args, reuse_port=True, worker=slot)).run()
+        finally:
+            shared_metrics.cleanup()
+    else:
+        serve(args)
+    print("\nServer stopped")
 
 if __name__ == '__main__':
     main()